@@ -3,15 +3,19 @@ Flask web application for audio instrument and note classification
 """
 
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import tensorflow as tf
+from service_streamer import ThreadedStreamer
 
 import config
 from audio_processor import AudioProcessor
+from quantize import TFLiteClassifier, fresh_serving_model_path
 
 app = Flask(__name__)
 CORS(app)
@@ -25,7 +29,16 @@ os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
 
 # Global variables for model and processor
 model = None
+infer_fn = None
+interpreter = None
 processor = None
+streamer = None
+
+# Executors for the async streaming endpoint: feature extraction scales with
+# cores; inference threads only wait on the batching streamer, so allow a full
+# batch of them to be in flight
+FEATURE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+INFER_POOL = ThreadPoolExecutor(max_workers=config.INFERENCE_BATCH_SIZE)
 
 
 def allowed_file(filename):
@@ -34,19 +47,80 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
 
 
+def top_k_indices(probs, k):
+    """Indices of the k largest probabilities, highest first"""
+    k = min(k, len(probs))
+    idx = np.argpartition(-probs, k - 1)[:k]
+    return idx[np.argsort(-probs[idx])]
+
+
+def configure_tensorflow():
+    """Size TensorFlow's thread pools to the host without oversubscribing"""
+    try:
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        tf.config.threading.set_intra_op_parallelism_threads(os.cpu_count())
+    except RuntimeError:
+        # Runtime already initialized; thread pools can no longer change
+        pass
+
+
 def load_model():
-    """Load the trained model"""
-    global model, processor
+    """Load the trained model, preferring an up-to-date quantized TFLite export"""
+    global model, infer_fn, interpreter, processor, streamer
+    
+    configure_tensorflow()
     
-    if not os.path.exists(config.MODEL_PATH):
+    tflite_path = fresh_serving_model_path()
+    
+    if tflite_path is not None:
+        print(f"Loading {config.TFLITE_SERVING_PRECISION} TFLite model...")
+        interpreter = TFLiteClassifier(tflite_path)
+    elif os.path.exists(config.MODEL_PATH):
+        print("Loading model...")
+        model = tf.keras.models.load_model(config.MODEL_PATH)
+        
+        # One graph for any batch size or clip length, so requests never retrace
+        @tf.function(input_signature=[tf.TensorSpec((None, config.N_MELS, None, 1), tf.float32)])
+        def _infer(x):
+            return model(x, training=False)
+        infer_fn = _infer
+        
+        # Trace the forward pass now rather than on the first request
+        infer_fn(tf.zeros((1, config.N_MELS, config.N_FRAMES, 1)))
+    else:
         raise FileNotFoundError(f"Model not found at {config.MODEL_PATH}. Please train the model first.")
     
-    print("Loading model...")
-    model = tf.keras.models.load_model(config.MODEL_PATH)
     processor = AudioProcessor()
+    
+    # Coalesce concurrent requests into one forward pass
+    streamer = ThreadedStreamer(Predictor().predict,
+                                batch_size=config.INFERENCE_BATCH_SIZE,
+                                max_latency=config.INFERENCE_MAX_LATENCY)
     print("Model loaded successfully!")
 
 
+def model_loaded():
+    """Check whether a model is ready for inference"""
+    return model is not None or interpreter is not None
+
+
+def run_model(features):
+    """Run the classifier on a batch of features"""
+    if interpreter is not None:
+        return interpreter.predict(features)
+    # The traced graph skips predict()'s per-call Python dispatch
+    instrument_pred, note_pred = infer_fn(tf.constant(features, dtype=tf.float32))
+    return instrument_pred.numpy(), note_pred.numpy()
+
+
+class Predictor:
+    """Runs the classifier on a batch of single-sample requests"""
+    
+    def predict(self, batch_feats):
+        instrument_pred, note_pred = run_model(np.stack(batch_feats))
+        return list(zip(instrument_pred, note_pred))
+
+
 @app.route('/')
 def index():
     """Render main page"""
@@ -67,6 +141,9 @@ def predict():
     Expected: audio file in 'file' field of multipart/form-data
     Returns: JSON with instrument, note, and confidence scores
     """
+    instruments = config.INSTRUMENTS
+    notes = config.NOTES
+    
     # Check if file is present
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -79,47 +156,41 @@ def predict():
     if not allowed_file(file.filename):
         return jsonify({'error': f'Invalid file type. Allowed types: {", ".join(config.ALLOWED_EXTENSIONS)}'}), 400
     
+    # Sanitized name is only used for logging; the upload never touches disk
+    filename = secure_filename(file.filename)
+    
     try:
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Preprocess audio
-        features = processor.process_audio_file(filepath)
-        features = np.expand_dims(features, axis=0)  # Add batch dimension
+        # Preprocess audio straight from the upload stream
+        features = processor.process_audio_stream(file.stream)
         
         # Make prediction
-        instrument_pred, note_pred = model.predict(features, verbose=0)
+        instrument_pred, note_pred = streamer.predict([features[0]])[0]
         
         # Get top predictions
-        instrument_idx = np.argmax(instrument_pred[0])
-        note_idx = np.argmax(note_pred[0])
+        instrument_idx = np.argmax(instrument_pred)
+        note_idx = np.argmax(note_pred)
         
-        instrument_confidence = float(instrument_pred[0][instrument_idx])
-        note_confidence = float(note_pred[0][note_idx])
+        instrument_confidence = float(instrument_pred[instrument_idx])
+        note_confidence = float(note_pred[note_idx])
         
-        instrument_name = config.INSTRUMENTS[instrument_idx]
-        note_name = config.NOTES[note_idx]
+        instrument_name = instruments[instrument_idx]
+        note_name = notes[note_idx]
         
         # Get top 3 predictions for each
         top_instruments = []
-        for idx in np.argsort(instrument_pred[0])[::-1][:3]:
+        for idx in top_k_indices(instrument_pred, 3):
             top_instruments.append({
-                'instrument': config.INSTRUMENTS[idx],
-                'confidence': float(instrument_pred[0][idx])
+                'instrument': instruments[idx],
+                'confidence': float(instrument_pred[idx])
             })
         
         top_notes = []
-        for idx in np.argsort(note_pred[0])[::-1][:5]:
+        for idx in top_k_indices(note_pred, 5):
             top_notes.append({
-                'note': config.NOTES[idx],
-                'confidence': float(note_pred[0][idx])
+                'note': notes[idx],
+                'confidence': float(note_pred[idx])
             })
         
-        # Clean up uploaded file
-        os.remove(filepath)
-        
         # Return results
         result = {
             'success': True,
@@ -134,10 +205,7 @@ def predict():
         return jsonify(result)
     
     except Exception as e:
-        # Clean up file if it exists
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
+        app.logger.warning(f"Prediction failed for {filename}: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -149,16 +217,20 @@ def info():
         'notes': config.NOTES,
         'num_instruments': config.NUM_INSTRUMENTS,
         'num_notes': config.NUM_NOTES,
-        'model_loaded': model is not None
+        'model_loaded': model_loaded()
     })
 
 
 @app.route('/api/predict-stream', methods=['POST'])
-def predict_stream():
+async def predict_stream():
     """
     Endpoint for streaming predictions (continuous recording)
-    Optimized for faster response
+    Optimized for faster response: preprocessing and inference run off the
+    request thread and the upload never touches disk
     """
+    instruments = config.INSTRUMENTS
+    notes = config.NOTES
+    
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -168,30 +240,24 @@ def predict_stream():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save temporarily
-        filename = secure_filename(f"stream_{datetime.now().timestamp()}.wav")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        loop = asyncio.get_running_loop()
         
-        # Preprocess audio
-        features = processor.process_audio_file(filepath)
-        features = np.expand_dims(features, axis=0)
+        # Preprocess audio straight from the upload stream
+        features = await loop.run_in_executor(FEATURE_POOL, processor.process_audio_stream, file.stream)
         
         # Make prediction
-        instrument_pred, note_pred = model.predict(features, verbose=0)
+        predictions = await loop.run_in_executor(INFER_POOL, streamer.predict, [features[0]])
+        instrument_pred, note_pred = predictions[0]
         
         # Get top predictions
-        instrument_idx = np.argmax(instrument_pred[0])
-        note_idx = np.argmax(note_pred[0])
-        
-        instrument_confidence = float(instrument_pred[0][instrument_idx])
-        note_confidence = float(note_pred[0][note_idx])
+        instrument_idx = np.argmax(instrument_pred)
+        note_idx = np.argmax(note_pred)
         
-        instrument_name = config.INSTRUMENTS[instrument_idx]
-        note_name = config.NOTES[note_idx]
+        instrument_confidence = float(instrument_pred[instrument_idx])
+        note_confidence = float(note_pred[note_idx])
         
-        # Clean up
-        os.remove(filepath)
+        instrument_name = instruments[instrument_idx]
+        note_name = notes[note_idx]
         
         # Return simplified result for speed
         result = {
@@ -206,10 +272,6 @@ def predict_stream():
         return jsonify(result)
     
     except Exception as e:
-        # Clean up file if it exists
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
-        
         return jsonify({'error': str(e)}), 500
 
 
@@ -218,7 +280,7 @@ def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model is not None
+        'model_loaded': model_loaded()
     })
 
 
@@ -235,8 +297,9 @@ if __name__ == '__main__':
     print("AUDIO INSTRUMENT AND NOTE CLASSIFIER - WEB APP")
     print("=" * 70)
     print(f"\nServer starting on http://localhost:5001")
-    print("Upload an audio file to get instrument and note predictions!\n")
+    print("Upload an audio file to get instrument and note predictions!")
+    print("For production, run: gunicorn -c gunicorn.conf.py wsgi:app\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    app.run(host='0.0.0.0', port=5001)
 
 
@@ -2,11 +2,22 @@
 Audio preprocessing module for instrument and note classification
 """
 
+import functools
+import os
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import librosa
 import numpy as np
+import scipy.fft
+import scipy.signal
+import scipy.sparse
 import soundfile as sf
-from typing import Tuple, Optional
+import soxr
+from typing import Optional
 import config
+from audio_processor_numba import mel_from_stft, fused_log_normalize, kernel_lock
 
 
 class AudioProcessor:
@@ -23,6 +34,27 @@ class AudioProcessor:
         self.target_length = int(sample_rate * duration)
         self.trim_silence = trim_silence
         self.top_db = top_db  # Threshold in dB below reference for silence detection
+        
+        # Analysis window and mel filterbank are constant for the processor's
+        # lifetime. The filterbank is ~98% zeros, so the kernel projects
+        # through its CSR form.
+        self._hann = scipy.signal.get_window('hann', n_fft).astype(np.float32)
+        self._mel_fb = librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels,
+                                           fmax=8000).astype(np.float32)
+        self._mel_csr = scipy.sparse.csr_matrix(self._mel_fb)
+        
+        # Scratch buffers are reused across calls, one set per thread
+        self._local = threading.local()
+    
+    def __getstate__(self):
+        # Thread-local scratch can't be pickled; workers allocate their own
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
     
     def load_audio(self, file_path: str) -> np.ndarray:
         """
@@ -35,19 +67,123 @@ class AudioProcessor:
             Audio signal as numpy array
         """
         try:
-            # Load audio file
-            audio, sr = librosa.load(file_path, sr=self.sample_rate, mono=True)
+            pcm = self._read_pcm16_wav(file_path)
+            if pcm is not None:
+                audio, sr = pcm
+            else:
+                try:
+                    audio, sr = sf.read(file_path, dtype='float32', always_2d=False)
+                except sf.LibsndfileError:
+                    # Containers libsndfile can't parse go through librosa/audioread
+                    audio, sr = librosa.load(file_path, sr=None, mono=True)
             
-            # Trim silence from beginning and end
-            if self.trim_silence:
-                audio, _ = librosa.effects.trim(audio, top_db=self.top_db)
+            return self._condition(audio, sr)
+        except Exception as e:
+            raise ValueError(f"Error loading audio file {file_path}: {str(e)}")
+    
+    def _read_pcm16_wav(self, file_path: str):
+        """
+        Read a 16-bit PCM WAV through a memory map of its data chunk
+        
+        Sample libraries are almost entirely plain PCM WAVs; mapping the data
+        lets repeat reads come straight from the page cache as one int16 ->
+        float32 conversion, without going through libsndfile.
+        
+        Args:
+            file_path: Path to audio file
             
-            # Pad or trim to target duration
-            audio = self._pad_or_trim(audio)
+        Returns:
+            (audio, sample_rate) with audio scaled to [-1, 1) and shaped
+            (frames,) or (frames, channels), or None for any other format
+        """
+        if not file_path.lower().endswith('.wav'):
+            return None
+        
+        # Keyed on size and mtime too, so a file rewritten in place is reparsed
+        stat = os.stat(file_path)
+        layout = _cached_wav_layout(file_path, stat.st_size, stat.st_mtime_ns)
+        if layout is None:
+            return None
+        
+        offset, frames, sr, channels = layout
+        shape = (frames,) if channels == 1 else (frames, channels)
+        pcm = np.memmap(file_path, dtype='<i2', mode='r', offset=offset, shape=shape)
+        audio = pcm.astype(np.float32)
+        audio *= 1.0 / 32768
+        return audio, sr
+    
+    def load_audio_buffer(self, fileobj) -> np.ndarray:
+        """
+        Load audio from a file object in memory and resample to target sample rate
+        
+        Args:
+            fileobj: Readable binary file object (e.g. an upload stream)
             
-            return audio
+        Returns:
+            Audio signal as numpy array
+        """
+        try:
+            try:
+                audio, sr = sf.read(fileobj, dtype='float32', always_2d=False)
+            except sf.LibsndfileError:
+                # Containers libsndfile can't parse (e.g. browser WebM recordings)
+                # still need audioread, which only reads from disk
+                return self._load_via_tempfile(fileobj)
+            
+            return self._condition(audio, sr)
         except Exception as e:
-            raise ValueError(f"Error loading audio file {file_path}: {str(e)}")
+            raise ValueError(f"Error loading audio stream: {str(e)}")
+    
+    def _condition(self, audio: np.ndarray, sr: int) -> np.ndarray:
+        """Mix down, resample, trim silence and fit decoded audio to target length"""
+        # Mix down to mono
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        
+        if sr != self.sample_rate:
+            # soxr HQ is librosa.load's default resampler, so features match
+            # the old load path; it is also ~3x faster than resample_poly
+            audio = soxr.resample(audio, sr, self.sample_rate, quality='HQ')
+        
+        # Trim silence from beginning and end
+        if self.trim_silence:
+            audio, _ = librosa.effects.trim(audio, top_db=self.top_db)
+        
+        # Pad or trim to target duration
+        return self._pad_or_trim(audio)
+    
+    def _load_via_tempfile(self, fileobj) -> np.ndarray:
+        """Spill a file object to disk and load it via load_audio"""
+        fileobj.seek(0)
+        fd, tmp_path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(fileobj.read())
+            return self.load_audio(tmp_path)
+        finally:
+            os.remove(tmp_path)
+    
+    def _mel_scratch(self, n_frames: int):
+        """Per-thread windowed-frame and mel power buffers sized for n_frames"""
+        scratch = getattr(self._local, 'mel', None)
+        if scratch is None or scratch[1].shape[1] != n_frames:
+            scratch = (np.empty((n_frames, self.n_fft), dtype=np.float32),
+                       np.empty((self.n_mels, n_frames), dtype=np.float32))
+            self._local.mel = scratch
+        return scratch
+    
+    def _aug_scratch(self, length: int):
+        """Per-thread ping-pong and noise buffers plus RNG for augmentation"""
+        scratch = getattr(self._local, 'aug', None)
+        if scratch is None or scratch[0].shape[0] != length:
+            # Seed from the global RNG so np.random.seed still reproduces runs
+            rng = getattr(self._local, 'rng', None) or np.random.default_rng(np.random.randint(2**32))
+            self._local.rng = rng
+            scratch = (np.empty(length, dtype=np.float32),
+                       np.empty(length, dtype=np.float32),
+                       np.empty(length, dtype=np.float32))
+            self._local.aug = scratch
+        return scratch
     
     def _pad_or_trim(self, audio: np.ndarray) -> np.ndarray:
         """Pad or trim audio to target length"""
@@ -62,58 +198,74 @@ class AudioProcessor:
     
     def extract_mel_spectrogram(self, audio: np.ndarray) -> np.ndarray:
         """
-        Extract mel spectrogram from audio signal
+        Extract normalized log-mel spectrogram from audio signal
+        
+        Equivalent to librosa's melspectrogram -> power_to_db(ref=np.max) ->
+        min-max normalization. Frames are windowed into scratch and
+        transformed with scipy's real FFT; power and mel projection run in
+        one Numba kernel, and log, clamp and normalize are fused into a second.
         
         Args:
             audio: Audio signal
             
         Returns:
-            Mel spectrogram (n_mels, time_steps)
+            Mel spectrogram (n_mels, time_steps) scaled to [0, 1]
         """
-        # Compute mel spectrogram
-        mel_spec = librosa.feature.melspectrogram(
-            y=audio,
-            sr=self.sample_rate,
-            n_mels=self.n_mels,
-            hop_length=self.hop_length,
-            n_fft=self.n_fft,
-            fmax=8000
-        )
+        # Centered frames, matching librosa.stft(center=True, pad_mode='constant')
+        pad = self.n_fft // 2
+        padded = np.pad(audio.astype(np.float32, copy=False), (pad, pad), mode='constant')
         
-        # Convert to log scale (dB)
-        mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+        n_frames = 1 + len(audio) // self.hop_length
+        frames, mel_power = self._mel_scratch(n_frames)
         
-        return mel_spec_db
-    
-    def normalize_spectrogram(self, mel_spec: np.ndarray) -> np.ndarray:
-        """Normalize mel spectrogram to [0, 1] range"""
-        # Normalize to 0-1 range
-        mel_spec_norm = (mel_spec - mel_spec.min()) / (mel_spec.max() - mel_spec.min() + 1e-8)
-        return mel_spec_norm
+        # Strided frame view -> windowed copy in scratch -> real FFT
+        frame_view = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft)[::self.hop_length]
+        np.multiply(frame_view, self._hann, out=frames)
+        stft = scipy.fft.rfft(frames, axis=1, overwrite_x=True)
+        
+        csr = self._mel_csr
+        with kernel_lock:
+            mel_from_stft(stft, csr.indptr, csr.indices, csr.data, mel_power)
+        
+        # Write into a fresh array, leaving the scratch for reuse
+        mel = np.empty_like(mel_power)
+        fused_log_normalize(mel_power, mel)
+        
+        return mel
     
     def process_audio_file(self, file_path: str) -> np.ndarray:
         """
-        Complete preprocessing pipeline: load -> extract features -> normalize
+        Complete preprocessing pipeline: load -> extract normalized features
         
         Args:
             file_path: Path to audio file
             
         Returns:
-            Preprocessed mel spectrogram ready for model input
+            Preprocessed mel spectrogram of shape (1, n_mels, time_steps, 1),
+            ready for model input
         """
         # Load audio
         audio = self.load_audio(file_path)
         
-        # Extract mel spectrogram
-        mel_spec = self.extract_mel_spectrogram(audio)
-        
-        # Normalize
-        mel_spec_norm = self.normalize_spectrogram(mel_spec)
+        # Extract normalized mel spectrogram
+        mel_spec_norm = self.extract_mel_spectrogram(audio)
         
-        # Add channel dimension for CNN input
-        mel_spec_norm = np.expand_dims(mel_spec_norm, axis=-1)
+        # Add batch and channel dimensions for CNN input (a view, no copy)
+        return mel_spec_norm.reshape(1, self.n_mels, -1, 1)
+    
+    def process_audio_stream(self, fileobj) -> np.ndarray:
+        """
+        Complete preprocessing pipeline for in-memory audio
         
-        return mel_spec_norm
+        Args:
+            fileobj: Readable binary file object
+            
+        Returns:
+            Preprocessed mel spectrogram of shape (1, n_mels, time_steps, 1)
+        """
+        audio = self.load_audio_buffer(fileobj)
+        mel_spec_norm = self.extract_mel_spectrogram(audio)
+        return mel_spec_norm.reshape(1, self.n_mels, -1, 1)
     
     # Data augmentation methods
     def augment_time_stretch(self, audio: np.ndarray, rate: Optional[float] = None) -> np.ndarray:
@@ -152,13 +304,15 @@ class AudioProcessor:
         )
         return shifted
     
-    def augment_add_noise(self, audio: np.ndarray, snr_db: Optional[float] = None) -> np.ndarray:
+    def augment_add_noise(self, audio: np.ndarray, snr_db: Optional[float] = None,
+                          out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Add white noise to audio
         
         Args:
             audio: Audio signal
             snr_db: Signal-to-noise ratio in dB
+            out: Optional buffer to write the result into (may be audio itself)
             
         Returns:
             Audio with added noise
@@ -167,22 +321,27 @@ class AudioProcessor:
             snr_db = np.random.uniform(*config.AUGMENT_NOISE_SNR_RANGE)
         
         # Calculate noise power based on signal power and desired SNR
-        signal_power = np.mean(audio ** 2)
+        signal_power = np.dot(audio, audio) / len(audio)
         noise_power = signal_power / (10 ** (snr_db / 10))
         
-        # Generate and add noise
-        noise = np.random.normal(0, np.sqrt(noise_power), len(audio))
-        noisy_audio = audio + noise
+        # Generate and add noise without temporaries
+        noise = self._aug_scratch(len(audio))[2]
+        self._local.rng.standard_normal(out=noise, dtype=np.float32)
+        noise *= np.sqrt(noise_power)
         
-        return noisy_audio
+        if out is None:
+            out = np.empty(len(audio), dtype=np.float32)
+        return np.add(audio, noise, out=out)
     
-    def augment_volume(self, audio: np.ndarray, gain_db: Optional[float] = None) -> np.ndarray:
+    def augment_volume(self, audio: np.ndarray, gain_db: Optional[float] = None,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Apply volume scaling augmentation
         
         Args:
             audio: Audio signal
             gain_db: Gain in dB (±20 dB)
+            out: Optional buffer to write the result into (may be audio itself)
             
         Returns:
             Volume-adjusted audio
@@ -191,7 +350,7 @@ class AudioProcessor:
             gain_db = np.random.uniform(-20, 20)
         
         gain_linear = 10 ** (gain_db / 20)
-        return audio * gain_linear
+        return np.multiply(audio, gain_linear, out=out)
     
     def apply_augmentations(self, audio: np.ndarray, 
                           time_stretch: bool = True,
@@ -209,9 +368,11 @@ class AudioProcessor:
             volume_change: Whether to change volume
             
         Returns:
-            Augmented audio
+            Augmented audio. May be the input itself (when nothing was applied)
+            or a per-thread scratch buffer reused by the next call, so copy it
+            if it must outlive the current sample.
         """
-        augmented = audio.copy()
+        augmented = audio
         
         if time_stretch and np.random.random() < 0.5:
             augmented = self.augment_time_stretch(augmented)
@@ -220,11 +381,16 @@ class AudioProcessor:
             # Use with caution for note classification
             augmented = self.augment_pitch_shift(augmented)
         
+        # Remaining stages ping-pong between two scratch buffers
+        buf_a, buf_b, _ = self._aug_scratch(len(augmented))
+        
         if add_noise and np.random.random() < 0.5:
-            augmented = self.augment_add_noise(augmented)
+            out = buf_b if augmented is buf_a else buf_a
+            augmented = self.augment_add_noise(augmented, out=out)
         
         if volume_change and np.random.random() < 0.5:
-            augmented = self.augment_volume(augmented)
+            out = buf_b if augmented is buf_a else buf_a
+            augmented = self.augment_volume(augmented, out=out)
         
         return augmented
 
@@ -232,7 +398,10 @@ class AudioProcessor:
 def extract_features_batch(file_paths: list, processor: AudioProcessor, 
                           augment: bool = False) -> np.ndarray:
     """
-    Extract features from multiple audio files
+    Extract features from multiple audio files in parallel
+    
+    Decoding, librosa and the mel kernel all release the GIL, so files are
+    processed on a thread pool. Output order follows file_paths.
     
     Args:
         file_paths: List of audio file paths
@@ -242,27 +411,112 @@ def extract_features_batch(file_paths: list, processor: AudioProcessor,
     Returns:
         Batch of preprocessed spectrograms
     """
-    features = []
-    
-    for file_path in file_paths:
+    def _one(file_path):
         try:
             audio = processor.load_audio(file_path)
             
             if augment:
                 audio = processor.apply_augmentations(audio, pitch_shift=False)
             
-            mel_spec = processor.extract_mel_spectrogram(audio)
-            mel_spec_norm = processor.normalize_spectrogram(mel_spec)
-            mel_spec_norm = np.expand_dims(mel_spec_norm, axis=-1)
-            
-            features.append(mel_spec_norm)
+            mel_spec_norm = processor.extract_mel_spectrogram(audio)
+            return np.expand_dims(mel_spec_norm, axis=-1)
         except Exception as e:
             print(f"Error processing {file_path}: {str(e)}")
-            continue
+            return None
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(_one, file_paths))
     
+    features = [mel for mel in results if mel is not None]
     return np.array(features)
 
 
+@functools.lru_cache(maxsize=4096)
+def _cached_wav_layout(file_path: str, size: int, mtime_ns: int):
+    """_pcm16_wav_layout memoized per file version, so repeat reads skip the parse"""
+    return _pcm16_wav_layout(file_path)
+
+
+def _pcm16_wav_layout(file_path: str):
+    """
+    Locate the sample data of a 16-bit PCM WAV file
+    
+    Returns:
+        (data offset, frames, sample rate, channels), or None if the file is
+        not a non-empty 16-bit PCM WAV
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id = chunk[:4]
+            size = struct.unpack('<I', chunk[4:])[0]
+            
+            if chunk_id == b'fmt ':
+                body = f.read(size + (size & 1))
+                if len(body) < 16:
+                    return None
+                fmt = struct.unpack('<HHIIHH', body[:16])
+            elif chunk_id == b'data':
+                if fmt is None:
+                    return None
+                format_tag, channels, sr, _, _, bits = fmt
+                if format_tag != 1 or bits != 16 or channels < 1:
+                    return None
+                offset = f.tell()
+                # Streamed WAVs may leave the size unset; trust the file length
+                size = min(size, os.fstat(f.fileno()).st_size - offset)
+                frames = size // (2 * channels)
+                if frames == 0:
+                    return None
+                return offset, frames, sr, channels
+            else:
+                # Chunks are word-aligned
+                f.seek(size + (size & 1), 1)
+
+
+# Per-process processor for ProcessPoolExecutor workers, set by the initializer
+# so it is pickled once per worker rather than once per task
+_worker_processor = None
+
+
+def init_feature_worker(processor: AudioProcessor):
+    """ProcessPoolExecutor initializer installing the worker's processor"""
+    global _worker_processor
+    _worker_processor = processor
+
+
+def featurize_in_worker(file_path: str, augment: bool = False) -> Optional[np.ndarray]:
+    """
+    Load and featurize one file inside a pool worker
+    
+    Args:
+        file_path: Path to audio file
+        augment: Whether to apply augmentations
+        
+    Returns:
+        Spectrogram (n_mels, time_steps, 1), or None if the file failed to load
+    """
+    processor = _worker_processor
+    try:
+        audio = processor.load_audio(file_path)
+        
+        if augment:
+            audio = processor.apply_augmentations(audio, pitch_shift=False)
+        
+        mel_spec_norm = processor.extract_mel_spectrogram(audio)
+        return np.expand_dims(mel_spec_norm, axis=-1)
+    except Exception as e:
+        print(f"Error processing file {file_path}: {str(e)}")
+        return None
+
+
 if __name__ == "__main__":
     # Test the audio processor
     processor = AudioProcessor()
@@ -0,0 +1,79 @@
+"""
+Numba-compiled kernels for the mel spectrogram hot path
+"""
+
+import contextlib
+import threading
+
+import numba
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True, nogil=True, parallel=True, fastmath=True)
+def mel_from_stft(stft, mel_indptr, mel_indices, mel_data, out):
+    """
+    Power spectrum projected onto a CSR mel filterbank
+
+    Args:
+        stft: complex64 STFT frames (n_frames, n_fft // 2 + 1)
+        mel_indptr, mel_indices, mel_data: CSR arrays of the mel filterbank
+        out: float32 buffer (n_mels, n_frames) receiving mel power
+    """
+    n_mels, n_frames = out.shape
+
+    for f in prange(n_frames):
+        frame = stft[f]
+        for m in range(n_mels):
+            acc = 0.0
+            for p in range(mel_indptr[m], mel_indptr[m + 1]):
+                x = frame[mel_indices[p]]
+                acc += mel_data[p] * (x.real * x.real + x.imag * x.imag)
+            out[m, f] = acc
+
+
+@njit(cache=True, nogil=True, fastmath=True)
+def fused_log_normalize(power, out):
+    """
+    Log-compress, clamp to 80 dB below the peak and min-max scale to [0, 1]
+
+    Equivalent to power_to_db(ref=np.max, top_db=80) followed by min-max
+    normalization, in two passes instead of five.
+
+    Args:
+        power: float32 mel power (n_mels, n_frames)
+        out: float32 buffer of the same shape (may be power itself)
+    """
+    n_mels, n_frames = power.shape
+
+    # Pass 1: log10 while tracking the range
+    mn = np.inf
+    mx = -np.inf
+    for m in range(n_mels):
+        for f in range(n_frames):
+            v = np.log10(max(power[m, f], 1e-10))
+            out[m, f] = v
+            mn = min(mn, v)
+            mx = max(mx, v)
+
+    # top_db=80 is 8 decades of power
+    floor = max(mn, mx - 8.0)
+    scale = 1.0 / (mx - floor + 1e-8)
+
+    # Pass 2: clamp and normalize in place
+    for m in range(n_mels):
+        for f in range(n_frames):
+            out[m, f] = (max(out[m, f], floor) - floor) * scale
+
+
+# Compile (or load from cache) at import so the first request doesn't pay for it
+mel_from_stft(np.zeros((3, 5), np.complex64), np.zeros(2, np.int32), np.zeros(0, np.int32),
+              np.zeros(0, np.float32), np.empty((1, 3), np.float32))
+fused_log_normalize(np.ones((1, 3), np.float32), np.empty((1, 3), np.float32))
+
+# The workqueue threading layer aborts on concurrent parallel launches, so
+# serialize kernel calls when neither TBB nor OpenMP is available
+if numba.threading_layer() == 'workqueue':
+    kernel_lock = threading.Lock()
+else:
+    kernel_lock = contextlib.nullcontext()
@@ -2,36 +2,46 @@
 Configuration file for the audio instrument and note classifier
 """
 
+import os
+
 # Audio processing parameters
 SAMPLE_RATE = 22050
 DURATION = 2.0  # seconds
 N_MELS = 128
 HOP_LENGTH = 512
 N_FFT = 2048
+N_FRAMES = 1 + int(SAMPLE_RATE * DURATION) // HOP_LENGTH  # Spectrogram time steps (87)
 TRIM_SILENCE = True  # Automatically trim silence from beginning/end
 SILENCE_THRESHOLD_DB = 20  # Threshold in dB for silence detection (higher = more aggressive)
 
 # Model parameters
-INSTRUMENTS = ['piano', 'violin', 'shepherds_flute']
+INSTRUMENTS = ('piano', 'violin', 'shepherds_flute')
 NUM_INSTRUMENTS = len(INSTRUMENTS)
 
 # Notes from C3 to B5 (3 octaves, chromatic scale)
-NOTES = [
+NOTES = (
     'C3', 'C#3', 'D3', 'D#3', 'E3', 'F3', 'F#3', 'G3', 'G#3', 'A3', 'A#3', 'B3',
     'C4', 'C#4', 'D4', 'D#4', 'E4', 'F4', 'F#4', 'G4', 'G#4', 'A4', 'A#4', 'B4',
     'C5', 'C#5', 'D5', 'D#5', 'E5', 'F5', 'F#5', 'G5', 'G#5', 'A5', 'A#5', 'B5'
-]
+)
 NUM_NOTES = len(NOTES)
 
 # Note name to MIDI number mapping
 NOTE_TO_MIDI = {note: 48 + i for i, note in enumerate(NOTES)}  # C3 is MIDI 48
 
+# Note name to class index, for O(1) label lookup
+NOTE_INDEX = {note: i for i, note in enumerate(NOTES)}
+
 # Training parameters
 BATCH_SIZE = 32
 EPOCHS = 100
 LEARNING_RATE = 0.001
 VALIDATION_SPLIT = 0.15
 TEST_SPLIT = 0.15
+XLA_JIT = os.environ.get('XLA_JIT', '1') != '0'  # XLA-compile train steps; XLA_JIT=0 to disable
+RANDOM_SEED = 42  # Seeds weight init and shuffling; ops stay non-deterministic for speed
+STEPS_PER_EXECUTION = 32  # Train steps run per tf.function call, amortizing Python dispatch
+MIXED_PRECISION = True  # Conv/Dense in float16 when a GPU is present; softmax outputs stay float32
 
 # Data augmentation parameters
 AUGMENT_TIME_STRETCH_RANGE = (0.9, 1.1)  # ±10%
@@ -43,13 +53,25 @@ DATA_DIR = 'data'
 TRAIN_DIR = f'{DATA_DIR}/train'
 VAL_DIR = f'{DATA_DIR}/validation'
 TEST_DIR = f'{DATA_DIR}/test'
+CACHE_DIR = f'{DATA_DIR}/cache'  # Precomputed spectrograms, or decoded waveforms for augmented splits
+CACHE_DTYPE = 'uint8'  # Cached spectrogram storage: 'uint8' (quantized) or 'float16'
+# Opt-in cache of waveforms conditioned by predict.py (e.g. PREDICT_CACHE_DIR=data/cache/predict)
+PREDICT_CACHE_DIR = os.environ.get('PREDICT_CACHE_DIR') or None
+PREDICT_CACHE_MAX_MB = 512  # Least recently used waveforms are evicted beyond this size
 MODEL_DIR = 'models'
 MODEL_PATH = f'{MODEL_DIR}/audio_classifier_model.h5'
-HISTORY_PATH = f'{MODEL_DIR}/training_history.json'
+TFLITE_MODEL_PATH = f'{MODEL_DIR}/audio_classifier_model_int8.tflite'
+TFLITE_FP16_MODEL_PATH = f'{MODEL_DIR}/audio_classifier_model_fp16.tflite'
+TFLITE_SERVING_PRECISION = 'int8'  # 'int8' or 'fp16' (if INT8 accuracy regresses)
+SAVED_MODEL_DIR = f'{MODEL_DIR}/saved_model'  # Fixed-shape SavedModel for XLA AOT compilation
+HISTORY_PATH = f'{MODEL_DIR}/training_history.csv'
 
 # Web app settings
 UPLOAD_FOLDER = 'uploads'
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10 MB
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'ogg', 'flac'}
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.flac')  # For str.endswith on lowercased names
+INFERENCE_BATCH_SIZE = 16  # Max requests coalesced into one forward pass
+INFERENCE_MAX_LATENCY = 0.02  # Seconds to wait for a batch to fill
 
 
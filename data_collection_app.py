@@ -4,6 +4,11 @@ Allows uploading audio files or recording live with labeling
 """
 
 import os
+import atexit
+import copy
+import tempfile
+import threading
+import time
 from flask import Flask, request, jsonify, render_template, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
@@ -28,11 +33,8 @@ os.makedirs(COLLECTION_FOLDER, exist_ok=True)
 STATS_FILE = 'data/collection_stats.json'
 
 
-def load_stats():
-    """Load collection statistics"""
-    if os.path.exists(STATS_FILE):
-        with open(STATS_FILE, 'r') as f:
-            return json.load(f)
+def empty_stats():
+    """Fresh statistics with every counter at zero"""
     return {
         'total_samples': 0,
         'by_instrument': {inst: 0 for inst in config.INSTRUMENTS},
@@ -41,26 +43,88 @@ def load_stats():
     }
 
 
+def load_stats():
+    """Load collection statistics"""
+    if os.path.exists(STATS_FILE):
+        with open(STATS_FILE, 'r') as f:
+            return json.load(f)
+    return empty_stats()
+
+
 def save_stats(stats):
-    """Save collection statistics"""
-    with open(STATS_FILE, 'w') as f:
-        json.dump(stats, f, indent=2)
+    """Save collection statistics, atomically replacing the previous file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(STATS_FILE) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stats, f, indent=2)
+        os.replace(tmp_path, STATS_FILE)
+    except Exception:
+        os.remove(tmp_path)
+        raise
 
 
-def update_stats(instrument, note):
-    """Update statistics after adding a sample"""
-    stats = load_stats()
-    stats['total_samples'] += 1
-    stats['by_instrument'][instrument] += 1
-    stats['by_note'][note] += 1
-    
-    combo_key = f"{instrument}_{note}"
-    if combo_key not in stats['by_combination']:
-        stats['by_combination'][combo_key] = 0
-    stats['by_combination'][combo_key] += 1
-    
-    save_stats(stats)
-    return stats
+# Statistics live in memory and are flushed to disk in the background
+STATS = load_stats()
+STATS_LOCK = threading.Lock()
+STATS_WRITE_LOCK = threading.Lock()  # Serializes flushes so snapshots land in order
+STATS_FLUSH_INTERVAL = 5  # Seconds
+_stats_dirty = False
+
+
+def snapshot_stats():
+    """Consistent copy of the in-memory statistics"""
+    with STATS_LOCK:
+        return copy.deepcopy(STATS)
+
+
+def flush_stats():
+    """Write the statistics to disk if they changed since the last flush"""
+    global _stats_dirty
+    with STATS_WRITE_LOCK:
+        with STATS_LOCK:
+            if not _stats_dirty:
+                return
+            snapshot = copy.deepcopy(STATS)
+            _stats_dirty = False
+        
+        try:
+            save_stats(snapshot)
+        except Exception:
+            # Leave the change pending so the next flush retries it
+            with STATS_LOCK:
+                _stats_dirty = True
+            raise
+
+
+def _flush_stats_periodically():
+    """Background loop persisting statistics"""
+    while True:
+        time.sleep(STATS_FLUSH_INTERVAL)
+        try:
+            flush_stats()
+        except OSError as e:
+            print(f"Warning: could not save stats: {e}")
+
+
+threading.Thread(target=_flush_stats_periodically, daemon=True).start()
+atexit.register(flush_stats)
+
+
+def update_stats(instrument, note, delta=1):
+    """Update statistics after adding (or, with delta=-1, retracting) a sample"""
+    global _stats_dirty
+    with STATS_LOCK:
+        STATS['total_samples'] += delta
+        STATS['by_instrument'][instrument] += delta
+        STATS['by_note'][note] += delta
+        
+        combo_key = f"{instrument}_{note}"
+        if combo_key not in STATS['by_combination']:
+            STATS['by_combination'][combo_key] = 0
+        STATS['by_combination'][combo_key] += delta
+        
+        _stats_dirty = True
+        return copy.deepcopy(STATS)
 
 
 def allowed_file(filename):
@@ -78,7 +142,7 @@ def index():
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get current collection statistics"""
-    stats = load_stats()
+    stats = snapshot_stats()
     return jsonify(stats)
 
 
@@ -123,10 +187,20 @@ def submit_sample():
         instrument_dir = os.path.join(app.config['COLLECTION_FOLDER'], instrument)
         os.makedirs(instrument_dir, exist_ok=True)
         
-        # Count existing files for this combination
-        existing_files = [f for f in os.listdir(instrument_dir) 
-                         if f.startswith(f"{note}_")]
-        count = len(existing_files) + 1
+        # Save under a temporary name first (its .part suffix keeps it out of
+        # the dataset), so a failed upload never reaches the statistics
+        fd, tmp_path = tempfile.mkstemp(dir=instrument_dir, prefix='.upload_', suffix='.part')
+        os.close(fd)
+        try:
+            file.save(tmp_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        
+        # Counting the sample reserves its number, so concurrent uploads
+        # can't collide on a filename
+        stats = update_stats(instrument, note)
+        count = stats['by_combination'][f"{instrument}_{note}"]
         
         # Generate filename
         ext = file.filename.rsplit('.', 1)[1].lower()
@@ -134,11 +208,12 @@ def submit_sample():
         filename = f"{note}_{count:03d}_{timestamp}.{ext}"
         filepath = os.path.join(instrument_dir, filename)
         
-        # Save file
-        file.save(filepath)
-        
-        # Update statistics
-        stats = update_stats(instrument, note)
+        try:
+            os.replace(tmp_path, filepath)
+        except Exception:
+            os.remove(tmp_path)
+            update_stats(instrument, note, delta=-1)
+            raise
         
         # Return success with updated stats
         return jsonify({
@@ -161,6 +236,8 @@ def move_to_dataset():
     """
     Move collected samples to train/val/test splits
     """
+    global _stats_dirty
+    
     try:
         from sklearn.model_selection import train_test_split
         
@@ -214,12 +291,11 @@ def move_to_dataset():
                         moved_count[split_name] += 1
         
         # Clear stats
-        save_stats({
-            'total_samples': 0,
-            'by_instrument': {inst: 0 for inst in config.INSTRUMENTS},
-            'by_note': {note: 0 for note in config.NOTES},
-            'by_combination': {}
-        })
+        with STATS_LOCK:
+            STATS.clear()
+            STATS.update(empty_stats())
+            _stats_dirty = True
+        flush_stats()
         
         return jsonify({
             'success': True,
@@ -234,7 +310,7 @@ def move_to_dataset():
 @app.route('/api/needed-samples', methods=['GET'])
 def needed_samples():
     """Get information about how many more samples are needed"""
-    stats = load_stats()
+    stats = snapshot_stats()
     
     target_per_combination = 100  # Recommended target
     
@@ -2,13 +2,32 @@
 Data generator for efficient loading and augmentation during training
 """
 
+import atexit
+import hashlib
+import json
+import multiprocessing
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import repeat
 import tensorflow as tf
 from tensorflow import keras
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 import config
-from audio_processor import AudioProcessor
+from audio_processor import AudioProcessor, init_feature_worker, featurize_in_worker
+
+
+# Bump when feature extraction code changes in ways its parameters don't show
+CACHE_FORMAT = 1
+
+
+def _file_stat(path: str) -> Optional[List[int]]:
+    """[size, mtime_ns] of a file, to detect in-place edits, or None if it is gone"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
 
 
 class AudioDataGenerator(keras.utils.Sequence):
@@ -17,7 +36,8 @@ class AudioDataGenerator(keras.utils.Sequence):
     """
     
     def __init__(self, data_dir: str, batch_size: int = config.BATCH_SIZE,
-                 shuffle: bool = True, augment: bool = False):
+                 shuffle: bool = True, augment: bool = False, cache_dir: Optional[str] = None,
+                 prefetch: int = 0):
         """
         Initialize data generator
         
@@ -26,26 +46,45 @@ class AudioDataGenerator(keras.utils.Sequence):
             batch_size: Batch size
             shuffle: Whether to shuffle data
             augment: Whether to apply data augmentation
+            cache_dir: Directory for a precomputed feature cache. When
+                augmenting, spectrograms change every epoch, so the decoded
+                waveforms are cached instead and augmented on top.
+            prefetch: Number of upcoming batches to prepare on a background
+                thread while the current one is consumed (0 disables)
         """
+        super().__init__()
         self.data_dir = data_dir
         self.batch_size = batch_size
         self.shuffle = shuffle
         self.augment = augment
         self.processor = AudioProcessor()
+        self._pool = None
+        self._pool_size = os.cpu_count()
+        
+        # Lookahead batches keyed by index, so out-of-order access still works
+        self.prefetch = prefetch
+        self._prefetch_thread = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._pending = {}
         
         # Load file paths and labels
         self.file_paths, self.instrument_labels, self.note_labels = self._load_data()
+        
+        self.mmap = None
+        self.waveforms = None
+        if cache_dir is not None:
+            self._build_cache(cache_dir)
+        
         self.indexes = np.arange(len(self.file_paths))
         
         if self.shuffle:
             np.random.shuffle(self.indexes)
     
-    def _load_data(self) -> Tuple[List[str], List[int], List[int]]:
+    def _load_data(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
         """
         Load file paths and create labels
         
         Returns:
-            file_paths, instrument_labels, note_labels
+            file_paths, instrument_labels, note_labels (labels as int32 arrays)
         """
         file_paths = []
         instrument_labels = []
@@ -60,25 +99,146 @@ class AudioDataGenerator(keras.utils.Sequence):
                 continue
             
             # Iterate through audio files in instrument directory
-            for filename in os.listdir(instrument_dir):
-                if not any(filename.lower().endswith(ext) for ext in ['.wav', '.mp3', '.ogg', '.flac']):
-                    continue
-                
-                # Extract note from filename (e.g., "C3_001.wav" -> "C3")
-                note_name = filename.split('_')[0]
-                
-                if note_name not in config.NOTES:
-                    print(f"Warning: Unknown note {note_name} in file {filename}")
-                    continue
-                
-                note_idx = config.NOTES.index(note_name)
-                
-                file_path = os.path.join(instrument_dir, filename)
-                file_paths.append(file_path)
-                instrument_labels.append(instrument_idx)
-                note_labels.append(note_idx)
-        
-        return file_paths, instrument_labels, note_labels
+            with os.scandir(instrument_dir) as entries:
+                for entry in entries:
+                    filename = entry.name
+                    if not filename.lower().endswith(config.AUDIO_EXTENSIONS):
+                        continue
+                    
+                    # Extract note from filename (e.g., "C3_001.wav" -> "C3")
+                    note_name = filename.partition('_')[0]
+                    note_idx = config.NOTE_INDEX.get(note_name)
+                    
+                    if note_idx is None:
+                        print(f"Warning: Unknown note {note_name} in file {filename}")
+                        continue
+                    
+                    file_paths.append(entry.path)
+                    instrument_labels.append(instrument_idx)
+                    note_labels.append(note_idx)
+        
+        return (file_paths, np.asarray(instrument_labels, dtype=np.int32),
+                np.asarray(note_labels, dtype=np.int32))
+    
+    def _build_cache(self, cache_dir: str):
+        """
+        Open the feature cache for this split, computing it on first use
+        
+        Spectrograms are stored in one memory-mapped array of shape
+        (N, n_mels, T, 1) next to a JSON manifest. With
+        config.CACHE_DTYPE 'uint8' the [0, 1] features are quantized to 256
+        levels (a quarter of the float32 size); 'float16' keeps more
+        precision at half the size. Augmented splits cache the decoded,
+        fixed-length waveforms as float16 of shape (N, samples) instead, so
+        later epochs skip decoding and resampling but still augment afresh.
+        The cache is rebuilt whenever the file list, feature shape, storage
+        dtype or processing parameters change; files whose size or mtime
+        changed since they were cached are recomputed in place. Files that
+        fail to load are dropped from the generator; labels always come from
+        the file list, filtered by the manifest's per-file 'valid' flags.
+        
+        Args:
+            cache_dir: Directory holding the cache files
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        if self.augment:
+            name, dtype, compute = 'waveforms', np.dtype(np.float16), self.processor.load_audio
+            shape = (len(self.file_paths), self.processor.target_length)
+        else:
+            name, dtype, compute = 'mels', np.dtype(config.CACHE_DTYPE), self._featurize
+            shape = (len(self.file_paths), self.processor.n_mels, config.N_FRAMES, 1)
+        data_path = os.path.join(cache_dir, f'{name}.{dtype.name}')
+        manifest_path = os.path.join(cache_dir, 'manifest.json')
+        quantized = np.issubdtype(dtype, np.integer)
+        
+        params = self._cache_params()
+        stats = [_file_stat(path) for path in self.file_paths]
+        
+        manifest = None
+        if os.path.exists(manifest_path) and os.path.exists(data_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if (manifest['files'] != self.file_paths or tuple(manifest['shape']) != shape
+                    or manifest['dtype'] != dtype.name or manifest.get('params') != params
+                    or len(manifest.get('stats', ())) != len(stats)):
+                manifest = None
+        
+        if manifest is None:
+            print(f"Building {name} cache in {cache_dir} ({len(self.file_paths)} files)...")
+            rows = list(range(len(self.file_paths)))
+            valid = [False] * len(self.file_paths)
+            mode = 'w+'
+        else:
+            # Same files and settings; only recompute files edited in place
+            rows = [i for i, stat in enumerate(stats) if manifest['stats'][i] != stat]
+            valid = manifest['valid']
+            mode = 'r+'
+            if rows:
+                print(f"Refreshing {len(rows)} changed files in {name} cache {cache_dir}...")
+        
+        if rows:
+            mmap = np.memmap(data_path, dtype=dtype, mode=mode, shape=shape)
+            
+            def _try_featurize(file_path):
+                try:
+                    return compute(file_path)
+                except Exception as e:
+                    print(f"Error processing file {file_path}: {str(e)}")
+                    return None
+            
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                paths = [self.file_paths[row] for row in rows]
+                for row, features in zip(rows, executor.map(_try_featurize, paths)):
+                    if features is not None:
+                        mmap[row] = np.round(features * 255) if quantized else features
+                    valid[row] = features is not None
+            mmap.flush()
+            del mmap
+            
+            manifest = {'shape': list(shape), 'dtype': dtype.name, 'params': params,
+                        'files': self.file_paths, 'stats': stats, 'valid': valid}
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f)
+        
+        cache = np.memmap(data_path, dtype=dtype, mode='r', shape=shape)
+        if self.augment:
+            self.waveforms = cache
+        else:
+            self.mmap = cache
+        self._cache_scale = 1.0 / 255 if quantized else 1.0
+        
+        # Keep only rows that featurized successfully
+        self._cache_rows = np.flatnonzero(manifest['valid'])
+        self.file_paths = [self.file_paths[i] for i in self._cache_rows]
+        self.instrument_labels = self.instrument_labels[self._cache_rows]
+        self.note_labels = self.note_labels[self._cache_rows]
+    
+    def _cache_params(self) -> dict:
+        """
+        Processing parameters cached features depend on, stored in the manifest
+        
+        Covers waveform conditioning (sample rate, duration, silence trimming)
+        and, for spectrogram caches, the spectrogram settings, with the mel
+        filterbank hashed so fmax and filterbank changes count too. Waveform
+        caches of augmented splits don't depend on the spectrogram settings,
+        so changing those leaves them valid.
+        """
+        p = self.processor
+        params = {
+            'format': CACHE_FORMAT,
+            'sample_rate': p.sample_rate,
+            'duration': p.duration,
+            'trim_silence': p.trim_silence,
+            'top_db': p.top_db,
+        }
+        if not self.augment:
+            params.update({
+                'n_mels': p.n_mels,
+                'n_fft': p.n_fft,
+                'hop_length': p.hop_length,
+                'mel_fb': hashlib.blake2b(p._mel_fb.tobytes(), digest_size=16).hexdigest(),
+            })
+        return params
     
     def __len__(self) -> int:
         """Number of batches per epoch"""
@@ -94,46 +254,126 @@ class AudioDataGenerator(keras.utils.Sequence):
         Returns:
             X (batch of spectrograms), (y_instrument, y_note)
         """
+        if not self.prefetch or self._prefetch_thread is None:
+            return self._load_batch(index)
+        
+        future = self._pending.pop(index, None)
+        
+        # Queue the next batches so they load while this one is consumed
+        for ahead in range(index + 1, min(index + 1 + self.prefetch, len(self))):
+            if ahead not in self._pending:
+                self._pending[ahead] = self._prefetch_thread.submit(self._load_batch, ahead)
+        
+        if future is None:
+            return self._load_batch(index)
+        return future.result()
+    
+    def _load_batch(self, index: int) -> Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """Build batch index from the current ordering"""
         # Get batch indexes
-        batch_indexes = self.indexes[index * self.batch_size:(index + 1) * self.batch_size]
+        batch_indexes = self.indexes[index * self.batch_size:(index + 1) * self.batch_size].copy()
         
         # Generate data
         X, y_instrument, y_note = self._generate_batch(batch_indexes)
         
         return X, {'instrument_output': y_instrument, 'note_output': y_note}
     
+    def _featurize(self, file_path: str) -> np.ndarray:
+        """Load one file, augment if enabled and return its (n_mels, T, 1) spectrogram"""
+        # Load and process audio
+        audio = self.processor.load_audio(file_path)
+        
+        # Apply augmentation if enabled
+        if self.augment:
+            audio = self.processor.apply_augmentations(audio, pitch_shift=False)
+        
+        # Extract features
+        mel_spec_norm = self.processor.extract_mel_spectrogram(audio)
+        return np.expand_dims(mel_spec_norm, axis=-1)
+    
+    def _read_cache(self, rows) -> np.ndarray:
+        """Gather cached rows and dequantize them to float32 in place"""
+        X = self.mmap[rows].astype(np.float32)
+        if self._cache_scale != 1.0:
+            X *= self._cache_scale
+        return X
+    
+    def _sample(self, idx: int) -> np.ndarray:
+        """Spectrogram for sample idx, from the cache when there is one"""
+        if self.mmap is not None:
+            return self._read_cache(self._cache_rows[idx])
+        return self._featurize(self.file_paths[idx])
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Worker processes for batch featurization, started on first use"""
+        if self._pool is None:
+            # Spawn rather than fork: forking a process that has initialized
+            # TensorFlow's thread pools can deadlock the children
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._pool_size,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_feature_worker,
+                initargs=(self.processor,))
+            # Shut the workers down before interpreter teardown if the
+            # generator is still alive then, rather than leaving it to the
+            # executor's weakref callback once its modules are gone
+            atexit.register(self._pool.shutdown)
+        return self._pool
+    
+    def close(self):
+        """Stop the featurization workers and the prefetch thread"""
+        pool, self._pool = getattr(self, '_pool', None), None
+        if pool is not None:
+            atexit.unregister(pool.shutdown)
+            pool.shutdown(wait=True, cancel_futures=True)
+        
+        prefetch_thread, self._prefetch_thread = getattr(self, '_prefetch_thread', None), None
+        if prefetch_thread is not None:
+            prefetch_thread.shutdown(wait=True, cancel_futures=True)
+        self._pending = {}
+    
+    def __del__(self):
+        """Release the workers when the generator is garbage collected"""
+        try:
+            self.close()
+        except Exception:
+            pass
+    
     def _generate_batch(self, batch_indexes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """Generate batch of data"""
-        X = []
-        y_instrument = []
-        y_note = []
+        if self.mmap is not None:
+            # A single gather from the cache, no decoding or feature extraction
+            X = self._read_cache(self._cache_rows[batch_indexes])
+            y_instrument = keras.utils.to_categorical(
+                self.instrument_labels[batch_indexes], num_classes=config.NUM_INSTRUMENTS)
+            y_note = keras.utils.to_categorical(
+                self.note_labels[batch_indexes], num_classes=config.NUM_NOTES)
+            return X, y_instrument, y_note
         
-        for idx in batch_indexes:
-            try:
-                file_path = self.file_paths[idx]
-                
-                # Load and process audio
-                audio = self.processor.load_audio(file_path)
-                
-                # Apply augmentation if enabled
-                if self.augment:
-                    audio = self.processor.apply_augmentations(audio, pitch_shift=False)
-                
-                # Extract features
-                mel_spec = self.processor.extract_mel_spectrogram(audio)
-                mel_spec_norm = self.processor.normalize_spectrogram(mel_spec)
-                mel_spec_norm = np.expand_dims(mel_spec_norm, axis=-1)
-                
-                X.append(mel_spec_norm)
-                y_instrument.append(self.instrument_labels[idx])
-                y_note.append(self.note_labels[idx])
-                
-            except Exception as e:
-                print(f"Error processing file {self.file_paths[idx]}: {str(e)}")
+        # Allocate the batch once; rows of files that fail to load are dropped
+        X = np.empty((len(batch_indexes), self.processor.n_mels, config.N_FRAMES, 1), dtype=np.float32)
+        loaded = np.zeros(len(batch_indexes), dtype=bool)
+        valid = 0
+        
+        # Featurize the batch across worker processes, in order
+        paths = [self.file_paths[idx] for idx in batch_indexes]
+        chunksize = max(1, len(paths) // self._pool_size)
+        mels = self._get_pool().map(featurize_in_worker, paths, repeat(self.augment),
+                                    chunksize=chunksize)
+        
+        for k, mel_spec_norm in enumerate(mels):
+            if mel_spec_norm is None:
                 continue
+            
+            X[valid] = mel_spec_norm
+            loaded[k] = True
+            valid += 1
+        
+        X = X[:valid]
         
-        # Convert to numpy arrays
-        X = np.array(X)
+        # Labels are a single gather from the label arrays
+        y_instrument = self.instrument_labels[batch_indexes[loaded]]
+        y_note = self.note_labels[batch_indexes[loaded]]
         
         # One-hot encode labels
         y_instrument = keras.utils.to_categorical(y_instrument, num_classes=config.NUM_INSTRUMENTS)
@@ -143,15 +383,158 @@ class AudioDataGenerator(keras.utils.Sequence):
     
     def on_epoch_end(self):
         """Update indexes after each epoch"""
+        if self._pending:
+            # Prefetched batches follow the old order; drop them and let any
+            # in-flight one finish before reshuffling
+            for future in self._pending.values():
+                future.cancel()
+            wait(self._pending.values())
+            self._pending.clear()
+        
         if self.shuffle:
             np.random.shuffle(self.indexes)
+    
+    def _waveform(self, idx: int) -> np.ndarray:
+        """Fixed-length (augmented, if enabled) waveform for sample idx"""
+        if self.waveforms is not None:
+            audio = self.waveforms[self._cache_rows[idx]].astype(np.float32)
+        else:
+            audio = self.processor.load_audio(self.file_paths[idx])
+        
+        if self.augment:
+            audio = self.processor.apply_augmentations(audio, pitch_shift=False)
+        
+        # Copy out of the processor's scratch before handing it to TensorFlow
+        return np.array(audio, dtype=np.float32)
+    
+    def to_dataset(self, cache: bool = False, repeat: bool = False) -> tf.data.Dataset:
+        """
+        Build a tf.data pipeline over the same files and labels
+        
+        Files are decoded (and augmented) on parallel map calls; spectrograms
+        are then computed for the whole batch at once in TensorFlow, and
+        batches are prefetched so all of it overlaps with training steps.
+        Generators backed by a spectrogram cache read from it instead, and
+        those backed by a waveform cache read from it before augmenting. Files
+        that fail to load are skipped, as in _generate_batch.
+        
+        Args:
+            cache: Keep loaded samples in memory after the first epoch
+                (only sensible without augmentation)
+            repeat: Repeat indefinitely, reshuffling each pass, so one
+                iterator and its workers and buffers live across epochs
+                (pair with steps_per_epoch=len(self)). Batches are then
+                all full, so XLA-compiled steps see one static shape
+            
+        Returns:
+            Dataset yielding (X, {'instrument_output': y, 'note_output': y})
+        """
+        ds = tf.data.Dataset.from_tensor_slices(
+            (np.arange(len(self.file_paths)),
+             self.instrument_labels,
+             self.note_labels))
+        
+        if self.shuffle:
+            ds = ds.shuffle(len(self.file_paths), reshuffle_each_iteration=True)
+        
+        if repeat:
+            ds = ds.repeat()
+        
+        if self.mmap is not None:
+            load_fn = self._sample
+            sample_shape = (self.processor.n_mels, config.N_FRAMES, 1)
+        else:
+            load_fn = self._waveform
+            sample_shape = (self.processor.target_length,)
+        
+        def _load(idx):
+            idx = int(idx.numpy())
+            try:
+                return load_fn(idx)
+            except Exception as e:
+                print(f"Error processing file {self.file_paths[idx]}: {str(e)}")
+                raise
+        
+        def _preprocess(idx, instrument, note):
+            x = tf.py_function(_load, [idx], tf.float32)
+            x.set_shape(sample_shape)
+            return x, {
+                'instrument_output': tf.one_hot(instrument, config.NUM_INSTRUMENTS),
+                'note_output': tf.one_hot(note, config.NUM_NOTES)
+            }
+        
+        ds = ds.map(_preprocess, num_parallel_calls=tf.data.AUTOTUNE)
+        ds = ds.ignore_errors()
+        
+        if cache and self.mmap is None:
+            ds = ds.cache()
+        
+        # An endless stream loses nothing by dropping the remainder
+        ds = ds.batch(self.batch_size, drop_remainder=repeat)
+        
+        if self.mmap is None:
+            batch_to_mel = make_batch_mel_fn(self.processor)
+            ds = ds.map(lambda waves, labels: (batch_to_mel(waves), labels),
+                        num_parallel_calls=tf.data.AUTOTUNE)
+        
+        # Shuffled data loses nothing if parallel calls finish out of order;
+        # a private pool keeps input work off the threads running train steps
+        options = tf.data.Options()
+        options.deterministic = not self.shuffle
+        options.autotune.enabled = True
+        options.threading.private_threadpool_size = os.cpu_count()
+        
+        return ds.prefetch(tf.data.AUTOTUNE).with_options(options)
+
+
+def make_batch_mel_fn(processor: AudioProcessor):
+    """
+    Build a TensorFlow function turning a batch of waveforms into spectrograms
+    
+    Mirrors AudioProcessor.extract_mel_spectrogram (centered frames, periodic
+    Hann window, the same librosa mel filterbank, 80 dB clamp and per-example
+    min-max scaling) so training features match those served by the app, but
+    runs one batched FFT for the whole minibatch.
+    
+    Args:
+        processor: AudioProcessor whose parameters and filterbank to use
+        
+    Returns:
+        Function mapping (batch, samples) float32 to (batch, n_mels, T, 1)
+    """
+    n_fft = processor.n_fft
+    hop_length = processor.hop_length
+    # librosa's Slaney-scale filterbank, not linear_to_mel_weight_matrix (HTK),
+    # which would shift every band relative to the serving features
+    mel_fb = tf.constant(processor._mel_fb.T)  # (n_fft // 2 + 1, n_mels)
+    
+    def batch_to_mel(waves):
+        pad = n_fft // 2
+        padded = tf.pad(waves, [[0, 0], [pad, pad]])
+        stft = tf.signal.stft(padded, frame_length=n_fft, frame_step=hop_length,
+                              fft_length=n_fft, window_fn=tf.signal.hann_window)
+        power = tf.math.square(tf.math.abs(stft))  # (batch, T, bins)
+        mel = tf.linalg.matmul(power, mel_fb)  # (batch, T, n_mels)
+        
+        log_mel = tf.math.log(tf.math.maximum(mel, 1e-10)) / tf.math.log(10.0)
+        mel_max = tf.math.reduce_max(log_mel, axis=[1, 2], keepdims=True)
+        log_mel = tf.math.maximum(log_mel, mel_max - 8.0)
+        mel_min = tf.math.reduce_min(log_mel, axis=[1, 2], keepdims=True)
+        mel_norm = (log_mel - mel_min) / (mel_max - mel_min + 1e-8)
+        
+        return tf.expand_dims(tf.transpose(mel_norm, [0, 2, 1]), axis=-1)
+    
+    return batch_to_mel
 
 
 def create_data_generators(train_dir: str = config.TRAIN_DIR,
                           val_dir: str = config.VAL_DIR,
-                          batch_size: int = config.BATCH_SIZE) -> Tuple[AudioDataGenerator, AudioDataGenerator]:
+                          batch_size: int = config.BATCH_SIZE) -> Tuple[tf.data.Dataset, tf.data.Dataset, int]:
     """
-    Create training and validation data generators
+    Create training and validation input pipelines
+    
+    The training pipeline repeats indefinitely so it isn't torn down and
+    refilled at every epoch boundary; pass steps_per_epoch to model.fit.
     
     Args:
         train_dir: Training data directory
@@ -159,23 +542,31 @@ def create_data_generators(train_dir: str = config.TRAIN_DIR,
         batch_size: Batch size
         
     Returns:
-        train_generator, val_generator
+        train_dataset, val_dataset, steps_per_epoch
     """
     train_generator = AudioDataGenerator(
         train_dir,
         batch_size=batch_size,
         shuffle=True,
-        augment=True
+        augment=True,
+        cache_dir=os.path.join(config.CACHE_DIR, os.path.basename(os.path.normpath(train_dir)))
     )
     
     val_generator = AudioDataGenerator(
         val_dir,
         batch_size=batch_size,
         shuffle=False,
-        augment=False
+        augment=False,
+        cache_dir=os.path.join(config.CACHE_DIR, os.path.basename(os.path.normpath(val_dir)))
     )
     
-    return train_generator, val_generator
+    print(f"Training samples: {len(train_generator.file_paths)}")
+    print(f"Validation samples: {len(val_generator.file_paths)}")
+    
+    # Training reads decoded waveforms and validation finished spectrograms
+    # from their on-disk caches
+    return (train_generator.to_dataset(repeat=True), val_generator.to_dataset(),
+            len(train_generator))
 
 
 if __name__ == "__main__":
@@ -4,8 +4,6 @@ This downloads a small set of audio samples to test the system
 """
 
 import os
-import urllib.request
-import json
 
 # Sample audio URLs (public domain or creative commons)
 # These are just examples - you'll need to find actual sources
@@ -87,44 +85,38 @@ def create_test_samples():
         test_dir = 'data/test_samples'
         os.makedirs(test_dir, exist_ok=True)
         
+        # Generate a few synthetic notes, all at once as a (notes, samples) array
+        notes = ['C4', 'D4', 'E4', 'F4', 'G4']
+        duration = 2.0
+        sample_rate = 22050
+        
+        frequencies = librosa.midi_to_hz(librosa.note_to_midi(notes))[:, np.newaxis]
+        t = np.linspace(0, duration, int(sample_rate * duration))[np.newaxis, :]
+        phase = 2 * np.pi * frequencies * t
+        
+        # Simple sine wave plus harmonics (not realistic but works for testing)
+        audio = 0.5 * np.sin(phase) + 0.3 * np.sin(2 * phase) + 0.2 * np.sin(3 * phase)
+        
+        # Apply envelope (attack, decay, sustain, release), shared by every note
+        envelope = np.ones(t.shape[1])
+        attack_samples = int(0.1 * sample_rate)
+        release_samples = int(0.2 * sample_rate)
+        
+        envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
+        envelope[-release_samples:] = np.linspace(1, 0, release_samples)
+        
+        audio *= envelope
+        
+        # The synthetic timbre is the same for every instrument
         for instrument in ['piano', 'violin', 'shepherds_flute']:
             instrument_dir = os.path.join(test_dir, instrument)
             os.makedirs(instrument_dir, exist_ok=True)
             
-            # Generate a few synthetic notes
-            notes = ['C4', 'D4', 'E4', 'F4', 'G4']
-            
-            for note in notes:
-                # Convert note to frequency
-                midi_note = librosa.note_to_midi(note)
-                frequency = librosa.midi_to_hz(midi_note)
-                
-                # Generate 2 seconds of audio
-                duration = 2.0
-                sample_rate = 22050
-                t = np.linspace(0, duration, int(sample_rate * duration))
-                
-                # Simple sine wave (not realistic but works for testing)
-                audio = 0.5 * np.sin(2 * np.pi * frequency * t)
-                
-                # Add some harmonics for more realistic sound
-                audio += 0.3 * np.sin(2 * np.pi * frequency * 2 * t)
-                audio += 0.2 * np.sin(2 * np.pi * frequency * 3 * t)
-                
-                # Apply envelope (attack, decay, sustain, release)
-                envelope = np.ones_like(audio)
-                attack_samples = int(0.1 * sample_rate)
-                release_samples = int(0.2 * sample_rate)
-                
-                envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
-                envelope[-release_samples:] = np.linspace(1, 0, release_samples)
-                
-                audio = audio * envelope
-                
+            for note, note_audio in zip(notes, audio):
                 # Save
                 filename = f"{note}_001.wav"
                 filepath = os.path.join(instrument_dir, filename)
-                sf.write(filepath, audio, sample_rate)
+                sf.write(filepath, note_audio, sample_rate)
                 
                 print(f"  Created: {filepath}")
         
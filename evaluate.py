@@ -2,11 +2,12 @@
 Model evaluation script with confusion matrices and metrics
 """
 
+import gc
 import os
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import confusion_matrix, classification_report, accuracy_score
+from sklearn.metrics import classification_report, accuracy_score
 import tensorflow as tf
 
 import config
@@ -36,34 +37,44 @@ def evaluate_model(model_path=config.MODEL_PATH, test_dir=config.TEST_DIR):
         test_dir,
         batch_size=config.BATCH_SIZE,
         shuffle=False,
-        augment=False
+        augment=False,
+        cache_dir=os.path.join(config.CACHE_DIR, os.path.basename(os.path.normpath(test_dir))),
+        prefetch=2
     )
     
     print(f"Test samples: {len(test_generator.file_paths)}")
     
-    # Make predictions
+    # Make predictions batch by batch into preallocated arrays; labels come
+    # from the same batches, so files that fail to load stay aligned
     print("\nMaking predictions...")
-    all_instrument_preds = []
-    all_note_preds = []
-    all_instrument_true = []
-    all_note_true = []
-    
+    num_samples = len(test_generator.file_paths)
+    all_instrument_preds = np.empty(num_samples, dtype=np.int32)
+    all_note_preds = np.empty(num_samples, dtype=np.int32)
+    all_instrument_true = np.empty(num_samples, dtype=np.int32)
+    all_note_true = np.empty(num_samples, dtype=np.int32)
+    top3_hits = np.empty(num_samples, dtype=bool)
+    
+    offset = 0
     for i in range(len(test_generator)):
         X, y = test_generator[i]
+        end = offset + X.shape[0]
+        instrument_probs, note_probs = model.predict_on_batch(X)
         
-        # Predict
-        instrument_pred, note_pred = model.predict(X, verbose=0)
+        all_instrument_preds[offset:end] = np.argmax(instrument_probs, axis=1)
+        all_note_preds[offset:end] = np.argmax(note_probs, axis=1)
+        all_instrument_true[offset:end] = np.argmax(y['instrument_output'], axis=1)
+        all_note_true[offset:end] = np.argmax(y['note_output'], axis=1)
         
-        # Store predictions and true labels
-        all_instrument_preds.extend(np.argmax(instrument_pred, axis=1))
-        all_note_preds.extend(np.argmax(note_pred, axis=1))
-        all_instrument_true.extend(np.argmax(y['instrument_output'], axis=1))
-        all_note_true.extend(np.argmax(y['note_output'], axis=1))
+        # Top-3 note hits, so the probability matrices never accumulate
+        top3 = np.argpartition(-note_probs, 2, axis=1)[:, :3]
+        top3_hits[offset:end] = (top3 == all_note_true[offset:end, None]).any(axis=1)
+        offset = end
     
-    all_instrument_preds = np.array(all_instrument_preds)
-    all_note_preds = np.array(all_note_preds)
-    all_instrument_true = np.array(all_instrument_true)
-    all_note_true = np.array(all_note_true)
+    all_instrument_preds = all_instrument_preds[:offset]
+    all_note_preds = all_note_preds[:offset]
+    all_instrument_true = all_instrument_true[:offset]
+    all_note_true = all_note_true[:offset]
+    top3_hits = top3_hits[:offset]
     
     # Calculate metrics
     print("\n" + "=" * 70)
@@ -85,19 +96,7 @@ def evaluate_model(model_path=config.MODEL_PATH, test_dir=config.TEST_DIR):
     print(f"Accuracy: {note_accuracy:.4f} ({note_accuracy*100:.2f}%)")
     
     # Top-3 accuracy for notes
-    correct_top3 = 0
-    for i in range(len(test_generator)):
-        X, y = test_generator[i]
-        _, note_pred = model.predict(X, verbose=0)
-        
-        true_labels = np.argmax(y['note_output'], axis=1)
-        top3_preds = np.argsort(note_pred, axis=1)[:, -3:]
-        
-        for j, true_label in enumerate(true_labels):
-            if true_label in top3_preds[j]:
-                correct_top3 += 1
-    
-    top3_accuracy = correct_top3 / len(all_note_true)
+    top3_accuracy = np.mean(top3_hits)
     print(f"Top-3 Accuracy: {top3_accuracy:.4f} ({top3_accuracy*100:.2f}%)")
     
     # Combined accuracy (both correct)
@@ -107,6 +106,11 @@ def evaluate_model(model_path=config.MODEL_PATH, test_dir=config.TEST_DIR):
     print(f"\n--- COMBINED TASK ---")
     print(f"Both Correct: {combined_accuracy:.4f} ({combined_accuracy*100:.2f}%)")
     
+    # Release the generator's cache mapping and prefetched batches before
+    # matplotlib allocates the large figures
+    del test_generator
+    gc.collect()
+    
     # Create visualizations
     print("\nGenerating visualizations...")
     os.makedirs('evaluation', exist_ok=True)
@@ -125,7 +129,8 @@ def evaluate_model(model_path=config.MODEL_PATH, test_dir=config.TEST_DIR):
         config.NOTES,
         title='Note Classification Confusion Matrix',
         save_path='evaluation/note_confusion_matrix.png',
-        figsize=(20, 18)
+        figsize=(20, 18),
+        dpi=150
     )
     
     # Per-instrument note accuracy
@@ -144,21 +149,29 @@ def evaluate_model(model_path=config.MODEL_PATH, test_dir=config.TEST_DIR):
     }
 
 
-def plot_confusion_matrix(y_true, y_pred, labels, title, save_path, figsize=(10, 8)):
+def plot_confusion_matrix(y_true, y_pred, labels, title, save_path, figsize=(10, 8), dpi=300):
     """Plot and save confusion matrix"""
-    cm = confusion_matrix(y_true, y_pred)
+    # One bincount over joint (true, pred) indices; sized by the label list
+    # so classes missing from the test set still get a row and column
+    num_classes = len(labels)
+    cm = np.bincount(y_true * num_classes + y_pred,
+                     minlength=num_classes * num_classes).reshape(num_classes, num_classes)
     
     # Normalize
-    cm_normalized = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
+    cm_normalized = cm / np.maximum(cm.sum(axis=1, keepdims=True), 1)
+    
+    # Cell annotations are only readable on small grids; on the note matrix
+    # they would be thousands of text artists
+    annot = len(labels) <= 16
     
     plt.figure(figsize=figsize)
-    sns.heatmap(cm_normalized, annot=True, fmt='.2f', cmap='Blues',
+    sns.heatmap(cm_normalized, annot=annot, fmt='.2f', cmap='Blues',
                 xticklabels=labels, yticklabels=labels, cbar_kws={'label': 'Accuracy'})
     plt.title(title)
     plt.ylabel('True Label')
     plt.xlabel('Predicted Label')
     plt.tight_layout()
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.savefig(save_path, dpi=dpi, bbox_inches='tight')
     plt.close()
     
     print(f"  Saved: {save_path}")
@@ -166,15 +179,12 @@ def plot_confusion_matrix(y_true, y_pred, labels, title, save_path, figsize=(10,
 
 def plot_per_instrument_accuracy(instrument_true, note_true, note_pred, save_path):
     """Plot note accuracy for each instrument"""
-    accuracies = []
-    
-    for i, instrument in enumerate(config.INSTRUMENTS):
-        mask = instrument_true == i
-        if np.sum(mask) > 0:
-            accuracy = accuracy_score(note_true[mask], note_pred[mask])
-            accuracies.append(accuracy)
-        else:
-            accuracies.append(0)
+    # Per-instrument totals and correct counts in two bincounts
+    correct = (note_true == note_pred).astype(np.int32)
+    total_per_instrument = np.bincount(instrument_true, minlength=config.NUM_INSTRUMENTS)
+    correct_per_instrument = np.bincount(instrument_true, weights=correct,
+                                         minlength=config.NUM_INSTRUMENTS)
+    accuracies = correct_per_instrument / np.maximum(total_per_instrument, 1)
     
     plt.figure(figsize=(10, 6))
     bars = plt.bar(config.INSTRUMENTS, accuracies, color=['#667eea', '#764ba2', '#f093fb'])
@@ -209,31 +219,37 @@ def analyze_errors(model_path=config.MODEL_PATH, test_dir=config.TEST_DIR, num_e
     print("\nAnalyzing errors...")
     
     model = tf.keras.models.load_model(model_path)
-    test_generator = AudioDataGenerator(test_dir, batch_size=1, shuffle=False, augment=False)
+    test_generator = AudioDataGenerator(
+        test_dir,
+        batch_size=config.BATCH_SIZE,
+        shuffle=False,
+        augment=False,
+        cache_dir=os.path.join(config.CACHE_DIR, os.path.basename(os.path.normpath(test_dir)))
+    )
     
-    errors = []
+    instrument_pred, note_pred = model.predict(test_generator, verbose=0)
+    instrument_pred_idx = np.argmax(instrument_pred, axis=1)
+    note_pred_idx = np.argmax(note_pred, axis=1)
+    instrument_true = test_generator.instrument_labels
+    note_true = test_generator.note_labels
     
-    for i in range(len(test_generator)):
-        X, y = test_generator[i]
-        instrument_pred, note_pred = model.predict(X, verbose=0)
-        
-        instrument_true = np.argmax(y['instrument_output'][0])
-        note_true = np.argmax(y['note_output'][0])
-        instrument_pred_idx = np.argmax(instrument_pred[0])
-        note_pred_idx = np.argmax(note_pred[0])
-        
-        if instrument_pred_idx != instrument_true or note_pred_idx != note_true:
-            errors.append({
-                'file': test_generator.file_paths[i],
-                'true_instrument': config.INSTRUMENTS[instrument_true],
-                'pred_instrument': config.INSTRUMENTS[instrument_pred_idx],
-                'true_note': config.NOTES[note_true],
-                'pred_note': config.NOTES[note_pred_idx],
-                'instrument_conf': instrument_pred[0][instrument_pred_idx],
-                'note_conf': note_pred[0][note_pred_idx]
-            })
-    
-    print(f"\nTotal errors: {len(errors)} out of {len(test_generator)} ({len(errors)/len(test_generator)*100:.1f}%)")
+    # Misclassified samples, selected with one mask
+    error_idx = np.flatnonzero((instrument_pred_idx != instrument_true) | (note_pred_idx != note_true))
+    
+    errors = []
+    for i in error_idx:
+        errors.append({
+            'file': test_generator.file_paths[i],
+            'true_instrument': config.INSTRUMENTS[instrument_true[i]],
+            'pred_instrument': config.INSTRUMENTS[instrument_pred_idx[i]],
+            'true_note': config.NOTES[note_true[i]],
+            'pred_note': config.NOTES[note_pred_idx[i]],
+            'instrument_conf': instrument_pred[i][instrument_pred_idx[i]],
+            'note_conf': note_pred[i][note_pred_idx[i]]
+        })
+    
+    num_samples = len(test_generator.file_paths)
+    print(f"\nTotal errors: {len(errors)} out of {num_samples} ({len(errors)/num_samples*100:.1f}%)")
     print(f"\nShowing first {min(num_errors, len(errors))} errors:")
     
     for i, error in enumerate(errors[:num_errors]):
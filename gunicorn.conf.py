@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration for the classifier web app
+
+A single process with many threads keeps one copy of the model in memory;
+TensorFlow and the mel kernel release the GIL, so requests overlap.
+"""
+
+import os
+
+bind = '0.0.0.0:5001'
+workers = 1
+worker_class = 'gthread'
+threads = int(os.cpu_count() * 2)
+timeout = 60
+
+# Load the model inside the worker rather than in the master: TensorFlow's
+# thread pools and the batching thread don't survive fork()
+preload_app = False
@@ -4,33 +4,289 @@ Standalone prediction script for inference on audio files
 
 import os
 import sys
+import hashlib
+import tempfile
 import numpy as np
+
+# Keep TensorFlow's C++ info/warning logs out of the CLI output
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
 import tensorflow as tf
 
 import config
 from audio_processor import AudioProcessor
+from data_generator import make_batch_mel_fn
+from model import fold_batch_norm
+from quantize import TFLiteClassifier, fresh_serving_model_path
+
+
+# Class names and MIDI numbers as arrays, for gathering whole batches at once
+_INSTRUMENTS = np.asarray(config.INSTRUMENTS)
+_NOTES = np.asarray(config.NOTES)
+_NOTE_MIDI = np.asarray([config.NOTE_TO_MIDI[note] for note in config.NOTES], dtype=np.int16)
+
+
+def top_k_indices(probs, k):
+    """Indices of the k largest probabilities along the last axis, highest first"""
+    k = min(k, probs.shape[-1])
+    idx = np.argpartition(-probs, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(probs, idx, axis=-1), axis=-1)
+    return np.take_along_axis(idx, order, axis=-1)
+
+
+def waveform_cache_key(audio_path):
+    """
+    Cache key for a file's conditioned waveform
+    
+    Hashes the first 64 KB of the file together with its size and mtime, plus
+    the conditioning parameters, so config changes and most edits miss the
+    cache. The key is deliberately cheap rather than strong: an edit past the
+    first 64 KB that keeps the file size and lands within the filesystem's
+    mtime granularity still hits, returning the old audio. Clear the cache
+    directory after rewriting files in place.
+    """
+    stat = os.stat(audio_path)
+    params = (config.SAMPLE_RATE, config.DURATION, config.TRIM_SILENCE, config.SILENCE_THRESHOLD_DB)
+    
+    h = hashlib.blake2b(digest_size=16)
+    with open(audio_path, 'rb') as f:
+        h.update(f.read(1 << 16))
+    h.update(repr((stat.st_size, stat.st_mtime_ns, params)).encode())
+    return h.hexdigest()
+
+
+def prune_waveform_cache(cache_dir, max_bytes):
+    """
+    Evict least recently used waveforms until the cache fits in max_bytes
+    
+    Hits refresh a file's mtime, so mtime order is recency order.
+    """
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_waveform(audio_path, processor, cache_dir=config.PREDICT_CACHE_DIR,
+                  max_cache_mb=config.PREDICT_CACHE_MAX_MB):
+    """
+    Decode, resample, trim and pad an audio file, reusing an earlier run's result
+    
+    Decoding and resampling dominate preprocessing; the spectrogram itself is
+    computed inside the inference graph. Caching is opt-in and bounded: the
+    least recently used waveforms are evicted once the directory exceeds
+    max_cache_mb. See waveform_cache_key for what invalidates an entry.
+    
+    Args:
+        audio_path: Path to audio file
+        processor: AudioProcessor instance
+        cache_dir: Directory of cached .npy waveforms (None disables caching)
+        max_cache_mb: Size cap of the cache directory in megabytes
+        
+    Returns:
+        Waveform of shape (target_length,)
+    """
+    if cache_dir is None:
+        return processor.load_audio(audio_path)
+    
+    cache_path = os.path.join(cache_dir, f'{waveform_cache_key(audio_path)}.npy')
+    try:
+        waveform = np.load(cache_path)
+        os.utime(cache_path)
+        return waveform
+    except (OSError, ValueError):
+        pass
+    
+    waveform = processor.load_audio(audio_path)
+    
+    # Write to a temporary name first so concurrent readers never see a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, waveform)
+    os.replace(tmp_path, cache_path)
+    
+    prune_waveform_cache(cache_dir, max_cache_mb * (1 << 20))
+    
+    return waveform
+
+
+def configure_tensorflow():
+    """
+    Set up the TensorFlow runtime for CLI inference
+    
+    Unless PREDICT_DEVICE=gpu, GPUs are hidden so no CUDA context (hundreds of
+    MB, seconds of startup) is created for one-file-at-a-time use; intra-op
+    threads are sized to the host for the oneDNN conv kernels.
+    """
+    try:
+        if os.environ.get('PREDICT_DEVICE', 'cpu') == 'cpu':
+            tf.config.set_visible_devices([], 'GPU')
+        tf.config.threading.set_intra_op_parallelism_threads(os.cpu_count())
+    except RuntimeError:
+        # Runtime already initialized; devices and thread pools can no longer change
+        pass
+
+
+def make_inference_fn(model, processor):
+    """
+    Compile spectrogram extraction and the Keras model into one XLA graph
+    
+    The mel spectrogram is computed with make_batch_mel_fn, which matches
+    AudioProcessor's features, so STFT, mel projection, log scaling and the
+    CNN are fused end to end. The signature leaves the batch dimension open,
+    so single files and whole batches share the same function.
+    
+    Args:
+        model: Trained Keras model
+        processor: AudioProcessor whose feature parameters to use
+        
+    Returns:
+        Callable mapping (N, target_length) waveforms to numpy
+        (instrument_probs, note_probs)
+    """
+    batch_to_mel = make_batch_mel_fn(processor)
+    compiled = tf.function(
+        lambda waves: model(batch_to_mel(waves), training=False),
+        jit_compile=config.XLA_JIT,
+        input_signature=[tf.TensorSpec((None, processor.target_length), tf.float32)]
+    )
+    
+    def infer(waveforms):
+        instrument_pred, note_pred = compiled(tf.constant(waveforms, dtype=tf.float32))
+        return instrument_pred.numpy(), note_pred.numpy()
+    
+    return infer
+
+
+def make_tflite_inference_fn(classifier, processor):
+    """
+    Waveform inference function for a TFLite export
+    
+    The interpreter takes spectrograms, so they are computed with the
+    processor first.
+    
+    Args:
+        classifier: TFLiteClassifier instance
+        processor: AudioProcessor instance
+        
+    Returns:
+        Callable mapping (N, target_length) waveforms to numpy
+        (instrument_probs, note_probs)
+    """
+    def infer(waveforms):
+        features = np.stack([processor.extract_mel_spectrogram(w) for w in waveforms])
+        return classifier.predict(features[..., np.newaxis])
+    
+    return infer
 
 
 def load_model_and_processor():
-    """Load trained model and audio processor"""
-    if not os.path.exists(config.MODEL_PATH):
-        raise FileNotFoundError(f"Model not found at {config.MODEL_PATH}. Please train the model first.")
+    """
+    Load the classifier as an inference function, plus the audio processor
+    
+    The quantized TFLite export (see quantize.py) is preferred when present
+    and at least as new as the Keras model; otherwise the Keras model has its BatchNormalization layers folded where
+    possible and is compiled together with feature extraction by
+    make_inference_fn. Either way the function takes conditioned waveforms.
+    """
+    configure_tensorflow()
     
-    print("Loading model...")
-    model = tf.keras.models.load_model(config.MODEL_PATH)
     processor = AudioProcessor()
+    tflite_path = fresh_serving_model_path()
+    
+    if tflite_path is not None:
+        print(f"Loading {config.TFLITE_SERVING_PRECISION} TFLite model...")
+        infer = make_tflite_inference_fn(TFLiteClassifier(tflite_path), processor)
+    elif os.path.exists(config.MODEL_PATH):
+        print("Loading model...")
+        model = tf.keras.models.load_model(config.MODEL_PATH, compile=False)
+        infer = make_inference_fn(fold_batch_norm(model), processor)
+    else:
+        raise FileNotFoundError(f"Model not found at {config.MODEL_PATH}. Please train the model first.")
+    
+    # Trace and XLA-compile (or allocate the interpreter) now, not on the first file
+    infer(np.zeros((1, processor.target_length), dtype=np.float32))
+    
     print("Model loaded successfully!\n")
     
-    return model, processor
+    return infer, processor
+
+
+def format_results(audio_paths, instrument_pred, note_pred, top_k=3):
+    """
+    Build the result dictionaries for a batch of files
+    
+    Top-k selection and the name, confidence and MIDI lookups are done for
+    the whole batch with array indexing; only the final dicts are built per
+    file.
+    
+    Args:
+        audio_paths: Paths of the audio files, one per row
+        instrument_pred: Instrument probabilities, shape (N, num_instruments)
+        note_pred: Note probabilities, shape (N, num_notes)
+        top_k: Number of top predictions to return
+        
+    Returns:
+        List of dictionaries with predictions
+    """
+    # Get top predictions
+    instrument_top_k = top_k_indices(instrument_pred, top_k)
+    note_top_k = top_k_indices(note_pred, top_k)
+    
+    instrument_names = _INSTRUMENTS[instrument_top_k].tolist()
+    instrument_confs = np.take_along_axis(instrument_pred, instrument_top_k, axis=1).tolist()
+    note_names = _NOTES[note_top_k].tolist()
+    note_confs = np.take_along_axis(note_pred, note_top_k, axis=1).tolist()
+    note_midis = _NOTE_MIDI[note_top_k].tolist()
+    
+    results = []
+    for i, audio_path in enumerate(audio_paths):
+        results.append({
+            'file': os.path.basename(audio_path),
+            'instrument': {
+                'prediction': instrument_names[i][0],
+                'confidence': instrument_confs[i][0],
+                'top_predictions': [
+                    {'instrument': name, 'confidence': conf}
+                    for name, conf in zip(instrument_names[i], instrument_confs[i])
+                ]
+            },
+            'note': {
+                'prediction': note_names[i][0],
+                'confidence': note_confs[i][0],
+                'midi_note': note_midis[i][0],
+                'top_predictions': [
+                    {'note': name, 'confidence': conf, 'midi': midi}
+                    for name, conf, midi in zip(note_names[i], note_confs[i], note_midis[i])
+                ]
+            }
+        })
+    
+    return results
 
 
-def predict_audio(audio_path, model, processor, top_k=3):
+def predict_audio(audio_path, infer, processor, top_k=3):
     """
     Predict instrument and note for an audio file
     
     Args:
         audio_path: Path to audio file
-        model: Trained Keras model
+        infer: Inference function from load_model_and_processor
         processor: AudioProcessor instance
         top_k: Number of top predictions to return
         
@@ -43,46 +299,12 @@ def predict_audio(audio_path, model, processor, top_k=3):
     print(f"Processing: {audio_path}")
     
     # Preprocess audio
-    features = processor.process_audio_file(audio_path)
-    features = np.expand_dims(features, axis=0)  # Add batch dimension
+    waveform = load_waveform(audio_path, processor)
     
     # Make prediction
-    instrument_pred, note_pred = model.predict(features, verbose=0)
+    instrument_pred, note_pred = infer(waveform[np.newaxis])
     
-    # Get top predictions
-    instrument_top_k = np.argsort(instrument_pred[0])[::-1][:top_k]
-    note_top_k = np.argsort(note_pred[0])[::-1][:top_k]
-    
-    # Format results
-    results = {
-        'file': os.path.basename(audio_path),
-        'instrument': {
-            'prediction': config.INSTRUMENTS[instrument_top_k[0]],
-            'confidence': float(instrument_pred[0][instrument_top_k[0]]),
-            'top_predictions': [
-                {
-                    'instrument': config.INSTRUMENTS[idx],
-                    'confidence': float(instrument_pred[0][idx])
-                }
-                for idx in instrument_top_k
-            ]
-        },
-        'note': {
-            'prediction': config.NOTES[note_top_k[0]],
-            'confidence': float(note_pred[0][note_top_k[0]]),
-            'midi_note': config.NOTE_TO_MIDI[config.NOTES[note_top_k[0]]],
-            'top_predictions': [
-                {
-                    'note': config.NOTES[idx],
-                    'confidence': float(note_pred[0][idx]),
-                    'midi': config.NOTE_TO_MIDI[config.NOTES[idx]]
-                }
-                for idx in note_top_k
-            ]
-        }
-    }
-    
-    return results
+    return format_results([audio_path], instrument_pred, note_pred, top_k)[0]
 
 
 def print_results(results):
@@ -115,22 +337,51 @@ def print_results(results):
     print("\n" + "=" * 70 + "\n")
 
 
-def predict_batch(audio_files, model, processor):
-    """Predict for multiple audio files"""
-    results = []
+def predict_batch(audio_files, infer, processor, batch_size=config.BATCH_SIZE):
+    """
+    Predict for multiple audio files
+    
+    Files are decoded on parallel tf.data map calls and classified a batch
+    at a time, with the next batch prepared while the current one runs
+    through the model. Files that fail to load are reported and skipped.
+    """
+    sample_shape = (processor.target_length,)
     
-    for audio_file in audio_files:
+    def _load(idx):
+        audio_file = audio_files[int(idx.numpy())]
         try:
-            result = predict_audio(audio_file, model, processor)
-            results.append(result)
-            print_results(result)
+            if not os.path.exists(audio_file):
+                raise FileNotFoundError(f"Audio file not found: {audio_file}")
+            return load_waveform(audio_file, processor), True
         except Exception as e:
             print(f"Error processing {audio_file}: {str(e)}\n")
+            return np.zeros(sample_shape, dtype=np.float32), False
+    
+    def _preprocess(idx):
+        waveform, ok = tf.py_function(_load, [idx], [tf.float32, tf.bool])
+        waveform.set_shape(sample_shape)
+        return waveform, ok, idx
+    
+    ds = tf.data.Dataset.range(len(audio_files))
+    ds = ds.map(_preprocess, num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    
+    results = []
+    for waveforms, ok, idx in ds:
+        ok = ok.numpy()
+        if not ok.any():
+            continue
+        
+        instrument_pred, note_pred = infer(waveforms.numpy()[ok])
+        batch_files = [audio_files[file_idx] for file_idx in idx.numpy()[ok]]
+        for result in format_results(batch_files, instrument_pred, note_pred):
+            results.append(result)
+            print_results(result)
     
     return results
 
 
-def interactive_mode(model, processor):
+def interactive_mode(infer, processor):
     """Interactive prediction mode"""
     print("\n" + "=" * 70)
     print("INTERACTIVE PREDICTION MODE")
@@ -148,7 +399,7 @@ def interactive_mode(model, processor):
             continue
         
         try:
-            result = predict_audio(audio_path, model, processor)
+            result = predict_audio(audio_path, infer, processor)
             print_results(result)
         except Exception as e:
             print(f"Error: {str(e)}")
@@ -162,7 +413,7 @@ def main():
     
     # Load model
     try:
-        model, processor = load_model_and_processor()
+        infer, processor = load_model_and_processor()
     except FileNotFoundError as e:
         print(f"Error: {e}")
         return
@@ -171,10 +422,10 @@ def main():
     if len(sys.argv) > 1:
         # Batch mode: predict for all provided files
         audio_files = sys.argv[1:]
-        predict_batch(audio_files, model, processor)
+        predict_batch(audio_files, infer, processor)
     else:
         # Interactive mode
-        interactive_mode(model, processor)
+        interactive_mode(infer, processor)
 
 
 if __name__ == "__main__":
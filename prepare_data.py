@@ -3,16 +3,46 @@ Data preparation script for downloading and organizing training data
 """
 
 import os
-import json
 import shutil
-import urllib.request
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import ijson
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
 import config
 
 
+def link_or_copy(src, dst):
+    """Hardlink src to dst, falling back to a copy (e.g. across filesystems)"""
+    if os.path.lexists(dst):
+        if os.path.samefile(src, dst):
+            return
+        # Replace rather than write through: dst may be a link to another source
+        os.remove(dst)
+    
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def copy_files(copies, max_workers=16):
+    """
+    Place files at their destinations concurrently
+    
+    Files are hardlinked where possible, so no audio bytes are duplicated;
+    the remaining copies are I/O-bound, so threads overlap their latency.
+    
+    Args:
+        copies: Iterable of (source, destination) paths
+        max_workers: Number of copy threads
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results so any copy error is raised here
+        list(executor.map(lambda pair: link_or_copy(*pair), copies))
+
+
 def create_directory_structure():
     """Create the directory structure for training data"""
     print("Creating directory structure...")
@@ -77,16 +107,9 @@ def filter_nsynth_data(nsynth_dir, output_dir='data/nsynth_filtered'):
         print(f"Error: Metadata file not found at {metadata_path}")
         return
     
-    with open(metadata_path, 'r') as f:
-        metadata = json.load(f)
-    
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    # Filter samples
-    piano_samples = []
-    violin_samples = []
-    
     # NSynth instrument families
     # Family 0: Bass, 1: Brass, 2: Flute, 3: Guitar, 4: Keyboard, 5: Mallet, 
     # 6: Organ, 7: Reed, 8: String, 9: Synth Lead, 10: Vocal
@@ -96,43 +119,46 @@ def filter_nsynth_data(nsynth_dir, output_dir='data/nsynth_filtered'):
         'string': 'violin'     # Family 8
     }
     
-    for sample_id, sample_data in metadata.items():
-        instrument_family = sample_data.get('instrument_family_str', '')
-        pitch = sample_data.get('pitch', 0)  # MIDI note number
-        
-        # Check if in our target range (C3=48 to B5=83)
-        if 48 <= pitch <= 83:
-            note_name = config.NOTES[pitch - 48]  # Convert MIDI to our note names
-            
-            if instrument_family in target_instruments:
-                instrument = target_instruments[instrument_family]
-                audio_file = os.path.join(nsynth_dir, 'audio', f'{sample_id}.wav')
-                
-                if os.path.exists(audio_file):
-                    if instrument == 'piano':
-                        piano_samples.append((audio_file, note_name))
-                    elif instrument == 'violin':
-                        violin_samples.append((audio_file, note_name))
-    
-    print(f"\nFound {len(piano_samples)} piano samples")
-    print(f"Found {len(violin_samples)} violin samples")
+    # Stream the (hundreds of MB) metadata and keep only target families in
+    # our range (MIDI C3=48 to B5=83), so the full dict is never in memory
+    metadata = {}
+    with open(metadata_path, 'rb') as f:
+        for sample_id, sample_data in ijson.kvitems(f, ''):
+            instrument_family = sample_data.get('instrument_family_str', '')
+            pitch = sample_data.get('pitch', 0)  # MIDI note number
+            if 48 <= pitch <= 83 and instrument_family in target_instruments:
+                metadata[sample_id] = (instrument_family, pitch)
+    
+    # One row per kept sample, in metadata order
+    df = pd.DataFrame.from_dict(metadata, orient='index',
+                                columns=['instrument_family_str', 'pitch'])
+    
+    # Convert MIDI to our note names
+    df = df.assign(
+        instrument=df['instrument_family_str'].map(target_instruments),
+        note=np.array(config.NOTES)[df['pitch'].to_numpy(dtype=int) - 48],
+        audio_file=(os.path.join(nsynth_dir, 'audio', '') + df.index.astype(str) + '.wav').to_numpy()
+    )
+    
+    # Only the remaining few thousand rows need a filesystem check
+    df = df[df['audio_file'].map(os.path.exists).astype(bool)]
+    
+    # Number samples per note, in metadata order
+    df['count'] = df.groupby(['instrument', 'note']).cumcount() + 1
+    
+    print(f"\nFound {(df['instrument'] == 'piano').sum()} piano samples")
+    print(f"Found {(df['instrument'] == 'violin').sum()} violin samples")
     
     # Copy filtered samples
-    for samples, instrument in [(piano_samples, 'piano'), (violin_samples, 'violin')]:
+    for instrument in ['piano', 'violin']:
         instrument_dir = os.path.join(output_dir, instrument)
         os.makedirs(instrument_dir, exist_ok=True)
         
-        note_counts = {}
-        for audio_file, note_name in samples:
-            # Count samples per note
-            if note_name not in note_counts:
-                note_counts[note_name] = 0
-            note_counts[note_name] += 1
-            
-            # Copy file
-            filename = f"{note_name}_{note_counts[note_name]:03d}.wav"
-            dest_path = os.path.join(instrument_dir, filename)
-            shutil.copy2(audio_file, dest_path)
+        samples = df[df['instrument'] == instrument]
+        copy_files(
+            (audio_file, os.path.join(instrument_dir, f"{note_name}_{count:03d}.wav"))
+            for audio_file, note_name, count in zip(samples['audio_file'], samples['note'], samples['count'])
+        )
         
         print(f"\nCopied {len(samples)} {instrument} samples to {instrument_dir}")
     
@@ -229,7 +255,7 @@ def split_data(source_dir, train_ratio=0.70, val_ratio=0.15, test_ratio=0.15):
         
         # Get all audio files
         audio_files = [f for f in os.listdir(instrument_dir) 
-                      if f.lower().endswith(('.wav', '.mp3', '.ogg', '.flac'))]
+                      if f.lower().endswith(config.AUDIO_EXTENSIONS)]
         
         if len(audio_files) == 0:
             print(f"Warning: No audio files found in {instrument_dir}")
@@ -248,10 +274,8 @@ def split_data(source_dir, train_ratio=0.70, val_ratio=0.15, test_ratio=0.15):
             dest_dir = os.path.join(dest_subdir, instrument)
             os.makedirs(dest_dir, exist_ok=True)
             
-            for filename in files:
-                src = os.path.join(instrument_dir, filename)
-                dst = os.path.join(dest_dir, filename)
-                shutil.copy2(src, dst)
+            copy_files((os.path.join(instrument_dir, filename), os.path.join(dest_dir, filename))
+                       for filename in files)
         
         print(f"{instrument}: {len(train_files)} train, {len(val_files)} val, {len(test_files)} test")
     
@@ -274,28 +298,25 @@ def create_metadata_csv():
             if not os.path.exists(instrument_dir):
                 continue
             
-            for filename in os.listdir(instrument_dir):
-                if not any(filename.lower().endswith(ext) for ext in ['.wav', '.mp3', '.ogg', '.flac']):
-                    continue
-                
-                # Extract note from filename
-                note_name = filename.split('_')[0]
-                if note_name not in config.NOTES:
-                    continue
-                
-                filepath = os.path.join(instrument_dir, filename)
-                
-                metadata.append({
-                    'filename': filename,
-                    'filepath': filepath,
-                    'instrument': instrument,
-                    'note': note_name,
-                    'midi_note': config.NOTE_TO_MIDI[note_name]
-                })
+            # One scandir pass; DirEntry.path saves a join per file
+            with os.scandir(instrument_dir) as entries:
+                for entry in entries:
+                    filename = entry.name
+                    if not filename.lower().endswith(config.AUDIO_EXTENSIONS):
+                        continue
+                    
+                    # Extract note from filename
+                    note_name = filename.partition('_')[0]
+                    midi_note = config.NOTE_TO_MIDI.get(note_name)
+                    if midi_note is None:
+                        continue
+                    
+                    metadata.append((filename, entry.path, instrument, note_name, midi_note))
         
         # Save to CSV
         if metadata:
-            df = pd.DataFrame(metadata)
+            df = pd.DataFrame(metadata,
+                              columns=['filename', 'filepath', 'instrument', 'note', 'midi_note'])
             csv_path = os.path.join(config.DATA_DIR, f'{split_name}_metadata.csv')
             df.to_csv(csv_path, index=False)
             print(f"  {split_name}: {len(metadata)} samples -> {csv_path}")
@@ -0,0 +1,261 @@
+"""
+Post-training quantization of the trained classifier to TensorFlow Lite
+"""
+
+import os
+import threading
+import numpy as np
+import tensorflow as tf
+
+import config
+from audio_processor import AudioProcessor
+from model import fold_batch_norm, to_float32
+
+
+def serving_model_path():
+    """Path of the TFLite export selected by config.TFLITE_SERVING_PRECISION"""
+    if config.TFLITE_SERVING_PRECISION == 'fp16':
+        return config.TFLITE_FP16_MODEL_PATH
+    return config.TFLITE_MODEL_PATH
+
+
+def fresh_serving_model_path():
+    """
+    Path of the selected TFLite export if it is usable, else None
+
+    An export older than the Keras model predates the last training run, so
+    it is skipped (with a warning) in favour of the retrained model.
+    """
+    tflite_path = serving_model_path()
+    if not os.path.exists(tflite_path):
+        return None
+    if (os.path.exists(config.MODEL_PATH)
+            and os.path.getmtime(tflite_path) < os.path.getmtime(config.MODEL_PATH)):
+        print(f"Warning: {tflite_path} is older than {config.MODEL_PATH}; "
+              f"using the Keras model. Re-run quantize.py to refresh the export.")
+        return None
+    return tflite_path
+
+
+def load_float32_model(model_path=config.MODEL_PATH):
+    """Load the trained Keras model with float32 compute for conversion"""
+    tf.keras.mixed_precision.set_global_policy('float32')
+    return to_float32(tf.keras.models.load_model(model_path, compile=False))
+
+
+def find_sample_paths(data_dir=config.TRAIN_DIR, num_samples=100, seed=42):
+    """
+    Pick a random subset of training files for calibration
+
+    Args:
+        data_dir: Directory containing instrument subdirectories
+        num_samples: Maximum number of files to return
+        seed: Random seed for reproducible calibration
+
+    Returns:
+        List of audio file paths
+    """
+    paths = []
+    for instrument in config.INSTRUMENTS:
+        instrument_dir = os.path.join(data_dir, instrument)
+        if not os.path.exists(instrument_dir):
+            continue
+        for filename in sorted(os.listdir(instrument_dir)):
+            if filename.lower().endswith(config.AUDIO_EXTENSIONS):
+                paths.append(os.path.join(instrument_dir, filename))
+
+    rng = np.random.default_rng(seed)
+    rng.shuffle(paths)
+    return paths[:num_samples]
+
+
+def representative_dataset(sample_paths, processor):
+    """Yield preprocessed mel spectrograms for INT8 calibration"""
+    for path in sample_paths:
+        features = processor.process_audio_file(path)
+        yield [features.astype(np.float32, copy=False)]
+
+
+def convert_to_int8(model_path=config.MODEL_PATH, output_path=config.TFLITE_MODEL_PATH,
+                    data_dir=config.TRAIN_DIR, num_samples=100):
+    """
+    Convert the trained Keras model to a fully INT8-quantized TFLite model
+
+    Args:
+        model_path: Path to trained Keras model
+        output_path: Path to save the .tflite model
+        data_dir: Directory with training data used for calibration
+        num_samples: Number of calibration samples
+
+    Returns:
+        Path to the saved TFLite model
+    """
+    sample_paths = find_sample_paths(data_dir, num_samples)
+    if not sample_paths:
+        raise FileNotFoundError(f"No calibration audio found in {data_dir}")
+
+    print(f"Loading model from {model_path}...")
+    model = load_float32_model(model_path)
+    processor = AudioProcessor()
+
+    print(f"Calibrating with {len(sample_paths)} samples...")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: representative_dataset(sample_paths, processor)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    tflite_model = converter.convert()
+
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+
+    print(f"INT8 model saved to: {output_path} ({len(tflite_model) / 1024:.0f} KB)")
+    return output_path
+
+
+def convert_to_fp16(model_path=config.MODEL_PATH, output_path=config.TFLITE_FP16_MODEL_PATH):
+    """
+    Convert the trained Keras model to a TFLite model with float16 weights
+
+    Fallback for when INT8 quantization costs too much accuracy; needs no
+    calibration data.
+
+    Args:
+        model_path: Path to trained Keras model
+        output_path: Path to save the .tflite model
+
+    Returns:
+        Path to the saved TFLite model
+    """
+    print(f"Loading model from {model_path}...")
+    model = load_float32_model(model_path)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+
+    print(f"FP16 model saved to: {output_path} ({len(tflite_model) / 1024:.0f} KB)")
+    return output_path
+
+
+def export_saved_model(model_path=config.MODEL_PATH, output_dir=config.SAVED_MODEL_DIR):
+    """
+    Export the classifier as a SavedModel with a fully static serving signature
+
+    XLA ahead-of-time compilation needs every dimension fixed, so the
+    signature takes exactly one (1, n_mels, T, 1) spectrogram. The result can
+    be compiled into a standalone CPU object file with no TensorFlow runtime:
+
+        saved_model_cli aot_compile_cpu --dir models/saved_model \
+            --tag_set serve --signature_def_key serving_default \
+            --output_prefix models/classifier --cpp_class Classifier
+
+    Args:
+        model_path: Path to trained Keras model
+        output_dir: Directory to write the SavedModel to
+
+    Returns:
+        Path to the SavedModel directory
+    """
+    print(f"Loading model from {model_path}...")
+    model = fold_batch_norm(load_float32_model(model_path))
+
+    module = tf.Module()
+    module.model = model
+
+    @tf.function(input_signature=[tf.TensorSpec((1, config.N_MELS, config.N_FRAMES, 1), tf.float32,
+                                                name='mel_spectrogram')])
+    def serve(features):
+        instrument_pred, note_pred = model(features, training=False)
+        return {'instrument_output': instrument_pred, 'note_output': note_pred}
+
+    module.serve = serve
+    tf.saved_model.save(module, output_dir, signatures={'serving_default': serve})
+
+    print(f"SavedModel saved to: {output_dir}")
+    return output_dir
+
+
+class TFLiteClassifier:
+    """
+    Runs a TFLite export of the classifier, handling (de)quantization
+    """
+
+    def __init__(self, model_path=config.TFLITE_MODEL_PATH, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path,
+                                               num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.input_dtype = self.input_details['dtype']
+
+        # Output order isn't guaranteed to follow Keras, so match heads by class count
+        output_details = self.interpreter.get_output_details()
+        self.instrument_details = next(d for d in output_details
+                                       if d['shape'][-1] == config.NUM_INSTRUMENTS)
+        self.note_details = next(d for d in output_details
+                                 if d['shape'][-1] == config.NUM_NOTES)
+
+        # The interpreter is not thread-safe
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _quantize(x, details):
+        """Map float input onto the tensor's (possibly quantized) dtype"""
+        scale, zero_point = details['quantization']
+        dtype = details['dtype']
+        if np.issubdtype(dtype, np.floating):
+            # float32, or float16 for half-precision exports
+            return x.astype(dtype, copy=False)
+        info = np.iinfo(dtype)
+        q = np.round(x / scale + zero_point)
+        return np.clip(q, info.min, info.max).astype(dtype)
+
+    @staticmethod
+    def _dequantize(q, details):
+        """Map a quantized output back to float probabilities"""
+        scale, zero_point = details['quantization']
+        if scale == 0:
+            return q.astype(np.float32)
+        return (q.astype(np.float32) - zero_point) * scale
+
+    def predict(self, features):
+        """
+        Run inference on a batch of mel spectrograms
+
+        Args:
+            features: Array of shape (batch, n_mels, time_steps, 1)
+
+        Returns:
+            instrument_pred, note_pred as float32 arrays
+        """
+        x = self._quantize(features, self.input_details)
+        index = self.input_details['index']
+
+        with self._lock:
+            if tuple(self.input_details['shape']) != x.shape:
+                self.interpreter.resize_tensor_input(index, x.shape)
+                self.interpreter.allocate_tensors()
+                self.input_details = self.interpreter.get_input_details()[0]
+
+            self.interpreter.set_tensor(index, x)
+            self.interpreter.invoke()
+            instrument_q = self.interpreter.get_tensor(self.instrument_details['index'])
+            note_q = self.interpreter.get_tensor(self.note_details['index'])
+
+        return (self._dequantize(instrument_q, self.instrument_details),
+                self._dequantize(note_q, self.note_details))
+
+
+if __name__ == "__main__":
+    if not os.path.exists(config.MODEL_PATH):
+        print(f"Error: Model not found at {config.MODEL_PATH}")
+        print("Please train the model first using train.py")
+    else:
+        convert_to_int8()
+        convert_to_fp16()
+        export_saved_model()
@@ -0,0 +1,14 @@
+"""
+WSGI entry point for serving the web app with gunicorn
+
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import app, load_model
+
+# Load the model once per worker at import time
+try:
+    load_model()
+except FileNotFoundError as e:
+    print(f"Warning: {e}")
+    print("Server will start but predictions will not work until model is trained.")